@@ -0,0 +1,198 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from aiohttp import web
+
+# Словарь для синтетических названий: поиск по ним находит по нескольку фильмов
+ADJECTIVES = [
+    "Тёмный", "Последний", "Красный", "Тихий", "Далёкий", "Забытый", "Ночной", "Северный",
+    "Ледяной", "Золотой", "Безумный", "Чёрный", "Стальной", "Старый", "Новый", "Вечный",
+]
+NOUNS = [
+    "рыцарь", "горизонт", "город", "остров", "шторм", "код", "путь", "сон", "берег", "призрак",
+    "патруль", "маршрут", "лес", "сигнал", "рейс", "архив", "экипаж", "свидетель", "капитан", "ветер",
+]
+GENRE_IDS = [28, 12, 16, 35, 80, 99, 18, 14, 27, 9648, 10749, 878, 53, 37]
+PAGE_SIZE = 20
+
+
+@dataclass
+class Faults:
+    """Задержка и ошибки, которые вносит заглушка."""
+    latency: float = 0.0      # средняя задержка ответа, секунд
+    error_rate: float = 0.0   # доля ответов 500
+    limit_rate: float = 0.0   # доля ответов 429
+    retry_after: int = 1
+
+    async def delay(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+    def pick(self) -> int:
+        roll = random.random()
+        if roll < self.limit_rate:
+            return 429
+        if roll < self.limit_rate + self.error_rate:
+            return 500
+        return 200
+
+
+@dataclass
+class CallLog:
+    calls: Counter = field(default_factory=Counter)
+    injected: Counter = field(default_factory=Counter)
+
+
+class FakeTmdb:
+    """Заглушка TMDB API v3: детерминированный каталог фильмов и нужные боту эндпоинты."""
+
+    def __init__(self, faults: Faults, movies: int = 2000, seed: int = 42):
+        self.faults = faults
+        self.log = CallLog()
+        rng = random.Random(seed)
+        self.movies = [self._movie(rng, movie_id) for movie_id in range(1, movies + 1)]
+        self.by_id = {movie["id"]: movie for movie in self.movies}
+
+    @staticmethod
+    def _movie(rng: random.Random, movie_id: int) -> dict:
+        title = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+        return {
+            "id": movie_id,
+            "title": title,
+            "original_title": title,
+            "overview": " ".join(rng.choice(NOUNS) for _ in range(rng.randint(20, 60))).capitalize() + ".",
+            "poster_path": f"/bench{movie_id}.jpg",
+            "release_date": f"{rng.randint(2015, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "popularity": round(rng.uniform(1, 500), 3),
+            "vote_average": round(rng.uniform(3, 9), 1),
+            "genre_ids": rng.sample(GENRE_IDS, 2),
+        }
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/3/discover/movie", self._discover)
+        app.router.add_get("/3/movie/top_rated", self._sorted("vote_average"))
+        app.router.add_get("/3/movie/now_playing", self._sorted("release_date"))
+        app.router.add_get("/3/trending/movie/week", self._sorted("popularity"))
+        app.router.add_get("/3/search/movie", self._search)
+        app.router.add_get("/3/movie/{movie_id:\\d+}", self._details)
+        return app
+
+    async def _respond(self, request: web.Request, endpoint: str, payload) -> web.Response:
+        self.log.calls[endpoint] += 1
+        await self.faults.delay()
+        status = self.faults.pick()
+        if status != 200:
+            self.log.injected[f"{endpoint} {status}"] += 1
+            headers = {"Retry-After": str(self.faults.retry_after)} if status == 429 else None
+            return web.json_response({"status_message": "injected"}, status=status, headers=headers)
+        return web.json_response(payload() if callable(payload) else payload)
+
+    @staticmethod
+    def _page(movies: list[dict], request: web.Request) -> dict:
+        page = max(int(request.query.get("page", 1)), 1)
+        start = (page - 1) * PAGE_SIZE
+        return {
+            "page": page,
+            "results": movies[start:start + PAGE_SIZE],
+            "total_results": len(movies),
+            "total_pages": max((len(movies) + PAGE_SIZE - 1) // PAGE_SIZE, 1),
+        }
+
+    async def _discover(self, request: web.Request) -> web.Response:
+        genre = int(request.query.get("with_genres", 0))
+        movies = sorted((m for m in self.movies if genre in m["genre_ids"]), key=lambda m: -m["popularity"])
+        return await self._respond(request, "/discover/movie", lambda: self._page(movies, request))
+
+    def _sorted(self, key: str):
+        ordered = sorted(self.movies, key=lambda m: m[key], reverse=True)
+
+        async def handler(request: web.Request) -> web.Response:
+            return await self._respond(request, request.path[2:], lambda: self._page(ordered, request))
+        return handler
+
+    async def _search(self, request: web.Request) -> web.Response:
+        query = request.query.get("query", "").lower().replace("ё", "е")
+        movies = [m for m in self.movies if query in m["title"].lower().replace("ё", "е")]
+        return await self._respond(request, "/search/movie", lambda: self._page(movies, request))
+
+    async def _details(self, request: web.Request) -> web.Response:
+        movie = self.by_id.get(int(request.match_info["movie_id"]))
+        if movie is None:
+            self.log.calls["/movie/{id}"] += 1
+            return web.json_response({"status_message": "not found"}, status=404)
+        return await self._respond(request, "/movie/{id}", movie)
+
+
+class FakeTelegram:
+    """Заглушка Telegram Bot API: принимает вызовы бота и отвечает правдоподобными объектами."""
+
+    def __init__(self, faults: Faults):
+        self.faults = faults
+        self.log = CallLog()
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    def _message(self, chat_id, **extra) -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **extra,
+        }
+
+    @staticmethod
+    def _photo(media: str) -> list[dict]:
+        file_id = media if not media.startswith("http") else f"bench-file-{abs(hash(media))}"
+        return [{"file_id": file_id, "file_unique_id": file_id[-16:], "width": 500, "height": 750}]
+
+    def _result(self, method: str, params) -> object:
+        chat_id = params.get("chat_id", 0)
+        if method == "sendMessage":
+            return self._message(chat_id, text=params.get("text", ""))
+        if method == "sendPhoto":
+            return self._message(chat_id, photo=self._photo(params.get("photo", "")), caption=params.get("caption"))
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            return [self._message(chat_id, photo=self._photo(item.get("media", ""))) for item in media]
+        if method in ("editMessageReplyMarkup", "editMessageText"):
+            return self._message(chat_id, text="")
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        return True
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.log.calls[method] += 1
+        params = await request.post()
+        await self.faults.delay()
+        status = self.faults.pick()
+        if status == 429:
+            self.log.injected[f"{method} 429"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.faults.retry_after}",
+                "parameters": {"retry_after": self.faults.retry_after},
+            })
+        if status == 500:
+            self.log.injected[f"{method} 500"] += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"})
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+
+async def start_server(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    """Запускает приложение на свободном порту; возвращает runner и базовый URL."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
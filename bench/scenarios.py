@@ -0,0 +1,90 @@
+import itertools
+import random
+import time
+from typing import Iterator
+
+from bench.fakes import ADJECTIVES, NOUNS
+
+# Диапазон telegram_id синтетических пользователей — не пересекается с настоящими
+USER_ID_BASE = 10 ** 12
+
+_update_ids = itertools.count(1)
+
+# Шаг сценария: (имя шага для отчёта, сырое обновление Telegram)
+Step = tuple[str, dict]
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"}
+
+
+def message(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def callback(user_id: int, data: str) -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "bench",
+            },
+        },
+    }
+
+
+def browse(user_id: int, rng: random.Random, genres: list[str], more: int) -> Iterator[Step]:
+    """Выбор жанра и несколько нажатий «Посмотреть ещё»."""
+    genre = rng.choice(genres)
+    yield "genre", message(user_id, genre)
+    for _ in range(more):
+        yield "more", callback(user_id, f"more_{genre}")
+
+
+def search(user_id: int, rng: random.Random) -> Iterator[Step]:
+    """/search, запрос и следующая страница результатов."""
+    query = rng.choice([*ADJECTIVES, *NOUNS])
+    yield "search_command", message(user_id, "/search")
+    yield "search_query", message(user_id, query)
+    yield "search_more", callback(user_id, "search_more|2")
+
+
+def favorites(user_id: int, rng: random.Random, movies: int) -> Iterator[Step]:
+    """Добавление в избранное, просмотр списка и удаление."""
+    movie_ids = rng.sample(range(1, movies + 1), 3)
+    for movie_id in movie_ids:
+        yield "favorite_add", callback(user_id, f"fav_{movie_id}")
+    yield "favorites_list", message(user_id, "⭐ Избранное")
+    yield "favorite_delete", callback(user_id, f"del_{movie_ids[0]}")
+
+
+def session(user_index: int, kinds: list[str], genres: list[str], movies: int, more: int, seed: int) -> Iterator[Step]:
+    """Полная сессия одного пользователя: /start и выбранные сценарии по порядку."""
+    user_id = USER_ID_BASE + user_index
+    rng = random.Random(seed + user_index)
+    yield "start", message(user_id, "/start")
+    for kind in kinds:
+        if kind == "browse":
+            yield from browse(user_id, rng, genres, more)
+        elif kind == "search":
+            yield from search(user_id, rng)
+        elif kind == "favorites":
+            yield from favorites(user_id, rng, movies)
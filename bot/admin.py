@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from aiogram import Router, Bot, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, FSInputFile
+from bot.config import ADMIN_IDS, PROFILE_MAX_SECONDS
+from bot.profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+# Команды только для администраторов (ADMIN_IDS); у остальных они проваливаются в основной роутер
+router = Router()
+router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+
+PROFILE_DEFAULT_SECONDS = 30
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _finish_profile(bot: Bot, chat_id: int) -> None:
+    try:
+        path = await profiler.wait()
+        logger.info(f"Профиль сохранён: {path} ({profiler.samples} замеров)")
+        await bot.send_document(
+            chat_id, FSInputFile(path),
+            caption=f"🔥 Профиль: {profiler.samples} замеров. Открыть: speedscope.app или flamegraph.pl",
+        )
+    except Exception as e:
+        logger.exception(f"Не удалось завершить профилирование: {e}")
+        await bot.send_message(chat_id, f"⚠️ Не удалось сохранить профиль: {e}")
+
+
+@router.message(Command("profile"))
+async def handle_profile(message: Message, command: CommandObject, bot: Bot):
+    """/profile [секунд] — запустить профилировщик; /profile stop — остановить досрочно."""
+    argument = (command.args or "").strip()
+    if argument == "stop":
+        if not profiler.running:
+            await message.answer("Профилирование не запущено.")
+            return
+        profiler.stop()
+        await message.answer("⏹ Останавливаю профилирование, профиль придёт следующим сообщением.")
+        return
+
+    if profiler.running:
+        await message.answer("Профилирование уже идёт. Остановить: /profile stop")
+        return
+    if argument and not argument.isdigit():
+        await message.answer("Использование: /profile [секунд] или /profile stop")
+        return
+    seconds = min(int(argument or PROFILE_DEFAULT_SECONDS), PROFILE_MAX_SECONDS)
+
+    profiler.start(seconds)
+    task = asyncio.create_task(_finish_profile(bot, message.chat.id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    await message.answer(f"▶️ Профилирование на {seconds} с запущено.")
@@ -1,9 +1,23 @@
+import asyncio
 import aiohttp
 import logging
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime
-from aiogram import Bot
-from bot.config import TMDB_API_KEY
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+from bot.config import (
+    TMDB_API_KEY, TMDB_LIMIT, TMDB_LIMIT_PER_HOST, TMDB_KEEPALIVE_TIMEOUT,
+    TMDB_DNS_CACHE_TTL, TMDB_TOTAL_TIMEOUT, TMDB_CONNECT_TIMEOUT, TMDB_CACHE_SIZE, TMDB_SHARED_CACHE,
+    TMDB_RATE, TMDB_BURST, TMDB_RETRIES, TMDB_RETRY_BASE_DELAY, TMDB_RETRY_MAX_DELAY,
+    TMDB_BREAKER_THRESHOLD, TMDB_BREAKER_RESET, TMDB_BREAKER_PROBE_TIMEOUT, TMDB_STALE_TTL, TMDB_BASE_URL,
+)
+from bot.cache import TTLCache, SingleFlight
+from bot.circuit import CircuitBreaker
+from bot.metrics import TMDB_REQUEST_SECONDS, TMDB_CACHE_LOOKUPS, endpoint_label
+from bot.ratelimit import AsyncRateLimiter
+from bot.storage import state_store
+from bot import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +28,7 @@ GENRES = {
     "Триллер 😱": 53, "Вестерн 🤠": 37
 }
 
-BASE_URL = "https://api.themoviedb.org/3"
+BASE_URL = TMDB_BASE_URL.rstrip("/")
 
 
 def base_params() -> dict:
@@ -25,21 +39,232 @@ def base_params() -> dict:
     }
 
 
-async def fetch(session: aiohttp.ClientSession, url: str, params: dict) -> dict:
-    """Выполняет HTTP GET-запрос к TMDB API."""
+# Время жизни ответов по эндпоинтам (секунды); 0 — не кэшировать
+ENDPOINT_TTLS = {
+    "/movie/top_rated": 6 * 3600,
+    "/trending/movie/week": 3 * 3600,
+    "/movie/now_playing": 3 * 3600,
+    "/discover/movie": 3600,
+    "/search/movie": 600,
+}
+DEFAULT_TTL = 3600
+
+response_cache = TTLCache(maxsize=TMDB_CACHE_SIZE, ttl=DEFAULT_TTL, stale_ttl=TMDB_STALE_TTL)
+_inflight = SingleFlight()
+_background_tasks: set[asyncio.Task] = set()
+
+# Исходящие запросы: не больше TMDB_RATE в секунду и быстрый отказ, пока TMDB лежит
+limiter = AsyncRateLimiter(TMDB_RATE, TMDB_BURST)
+breaker = CircuitBreaker("TMDB", TMDB_BREAKER_THRESHOLD, TMDB_BREAKER_RESET, TMDB_BREAKER_PROBE_TIMEOUT)
+
+# Подписчики на свежие ответы TMDB со списком фильмов (каталог и т.п.)
+_results_hooks: list[Callable[[list[dict]], None]] = []
+
+
+def add_results_hook(hook: Callable[[list[dict]], None]) -> None:
+    """Регистрирует обработчик, получающий results каждого ответа TMDB из сети."""
+    _results_hooks.append(hook)
+
+
+def _notify_results(data: dict) -> None:
+    results = data.get("results")
+    if not results:
+        return
+    for hook in _results_hooks:
+        try:
+            hook(results)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике ответа TMDB: {e}")
+
+
+def _path(url: str) -> str:
+    return url[len(BASE_URL):] if url.startswith(BASE_URL) else url
+
+
+def endpoint_ttl(url: str) -> int:
+    """Возвращает TTL кэша для эндпоинта TMDB."""
+    return ENDPOINT_TTLS.get(_path(url), DEFAULT_TTL)
+
+
+def cache_key(url: str, params: dict) -> tuple:
+    """Нормализованный ключ кэша: URL и отсортированные параметры без api_key."""
+    items = tuple(sorted((k, str(v)) for k, v in params.items() if k != "api_key"))
+    return url.rstrip("/"), items
+
+
+def _shared_key(key: tuple) -> str:
+    url, items = key
+    return "tmdb:" + url + "?" + "&".join(f"{k}={v}" for k, v in items)
+
+
+def cache_stats() -> dict:
+    """Счётчики кэша: misses включают coalesced — промахи, не дошедшие до TMDB."""
+    return {
+        **response_cache.stats.as_dict(), "size": len(response_cache),
+        "breaker": breaker.state, "breaker_rejected": breaker.rejected,
+    }
+
+
+def _retry_after(headers) -> Optional[float]:
+    """Пауза из заголовка Retry-After (секунды или HTTP-дата)."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
     try:
-        async with session.get(url, params=params) as response:
-            if response.status != 200:
-                error_msg = f"TMDB API error: {response.status} - {await response.text()}"
-                logger.error(error_msg)
-                return {"error": error_msg}
-            return await response.json()
-    except aiohttp.ClientError as e:
-        logger.exception(f"Ошибка при выполнении запроса к TMDB: {e}")
-        return {"error": str(e)}
-
-
-async def fetch_movies_by_genre(session: aiohttp.ClientSession, genre_name: str, page: int = 1) -> dict:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+def _backoff(attempt: int) -> float:
+    # Экспонента с полным джиттером: повторы разных запросов не совпадают по времени
+    return random.uniform(0, min(TMDB_RETRY_MAX_DELAY, TMDB_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def _fetch_upstream(session: aiohttp.ClientSession, url: str, params: dict) -> dict:
+    """Выполняет HTTP GET-запрос к TMDB API с ограничением частоты, повторами и размыкателем."""
+    endpoint = endpoint_label(_path(url))
+    if not breaker.allow():
+        TMDB_REQUEST_SECONDS.labels(endpoint, "circuit_open").observe(0)
+        tracing.annotate(circuit="open")
+        return {"error": "TMDB временно недоступен (цепь разомкнута)"}
+
+    # Исход каждого вызова должен попасть в размыкатель, иначе пробный запрос оставит цепь полуоткрытой
+    settled = False
+    try:
+        error = ""
+        for attempt in range(TMDB_RETRIES + 1):
+            await limiter.acquire()
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                async with session.get(url, params=params) as response:
+                    elapsed = time.perf_counter() - started
+                    TMDB_REQUEST_SECONDS.labels(endpoint, str(response.status)).observe(elapsed)
+                    tracing.record("tmdb.request", started, elapsed, status=response.status, attempt=attempt)
+                    if response.status == 200:
+                        data = await response.json()
+                        breaker.record_success()
+                        settled = True
+                        return data
+                    error = f"TMDB API error: {response.status} - {await response.text()}"
+                    if response.status != 429 and response.status < 500:
+                        # 4xx кроме 429 — ошибка запроса, а не сбой TMDB: не повторяем
+                        logger.error(error)
+                        breaker.record_success()
+                        settled = True
+                        return {"error": error}
+                    retry_after = _retry_after(response.headers)
+                    if response.status == 429:
+                        # Лимит общий на ключ API — притормаживаем все запросы процесса
+                        limiter.pause(retry_after if retry_after is not None else _backoff(attempt + 1))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                elapsed = time.perf_counter() - started
+                TMDB_REQUEST_SECONDS.labels(endpoint, type(e).__name__).observe(elapsed)
+                tracing.record("tmdb.request", started, elapsed, status=type(e).__name__, attempt=attempt)
+                error = str(e) or type(e).__name__
+
+            if attempt == TMDB_RETRIES:
+                break
+            delay = retry_after if retry_after is not None else _backoff(attempt)
+            if delay > TMDB_RETRY_MAX_DELAY:
+                break  # ждать дольше — хуже, чем отдать ошибку или устаревший ответ
+            logger.warning(f"TMDB: попытка {attempt + 1} не удалась ({error}), повтор через {delay:.2f} с")
+            await asyncio.sleep(delay)
+
+        breaker.record_failure()
+        settled = True
+        logger.error(f"Ошибка при выполнении запроса к TMDB: {error}")
+        return {"error": error}
+    except asyncio.CancelledError:
+        if not settled:
+            breaker.release()
+            settled = True
+        raise
+    finally:
+        if not settled:
+            breaker.record_failure()
+
+
+def _revalidate(key: tuple, load: Callable[[], Awaitable[dict]]) -> None:
+    if _inflight.is_inflight(key):
+        return
+    task = asyncio.create_task(_inflight.do(key, load))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def fetch(session: aiohttp.ClientSession, url: str, params: dict, refresh: bool = False) -> dict:
+    """Выполняет запрос к TMDB через кэш с объединением одновременных запросов.
+
+    Истёкшая запись отдаётся сразу и обновляется в фоне (stale-while-revalidate);
+    если TMDB не ответил, отдаётся последний удачный ответ, пока не прошёл TMDB_STALE_TTL.
+    refresh=True — не читать кэш, а обновить запись из TMDB (для прогрева кэша).
+    Возвращаемый словарь общий для всех вызывающих — не изменяйте его.
+    """
+    with tracing.span("tmdb.fetch", endpoint=endpoint_label(_path(url)), page=params.get("page")):
+        return await _fetch_cached(session, url, params, refresh)
+
+
+async def _fetch_cached(session: aiohttp.ClientSession, url: str, params: dict, refresh: bool) -> dict:
+    ttl = endpoint_ttl(url)
+    if ttl <= 0:
+        tracing.annotate(cache="off")
+        return await _fetch_upstream(session, url, params)
+
+    key = cache_key(url, params)
+
+    async def load() -> dict:
+        if TMDB_SHARED_CACHE and not refresh:
+            # Второй уровень — общий для всех процессов; остаток TTL там неизвестен,
+            # поэтому локальная копия может прожить до двух TTL
+            shared = await state_store.get(_shared_key(key))
+            if shared is not None:
+                response_cache.set(key, shared, ttl)
+                return shared
+        data = await _fetch_upstream(session, url, params)
+        if "error" not in data:
+            response_cache.set(key, data, ttl)
+            if TMDB_SHARED_CACHE:
+                await state_store.set(_shared_key(key), data, ttl)
+            _notify_results(data)
+        return data
+
+    endpoint = endpoint_label(_path(url))
+    if not refresh:
+        cached = response_cache.get(key)
+        if cached is not None:
+            TMDB_CACHE_LOOKUPS.labels(endpoint, "hit").inc()
+            tracing.annotate(cache="hit")
+            return cached
+        stale = response_cache.get_stale(key)
+        if stale is not None:
+            TMDB_CACHE_LOOKUPS.labels(endpoint, "stale").inc()
+            tracing.annotate(cache="stale")
+            _revalidate(key, load)
+            return stale
+    TMDB_CACHE_LOOKUPS.labels(endpoint, "refresh" if refresh else "miss").inc()
+
+    if _inflight.is_inflight(key):
+        response_cache.stats.coalesced += 1
+        tracing.annotate(cache="coalesced")
+    else:
+        tracing.annotate(cache="refresh" if refresh else "miss")
+
+    data = await _inflight.do(key, load)
+    if "error" in data:
+        stale = response_cache.get_stale(key)
+        if stale is not None:
+            logger.warning(f"TMDB: отдаём устаревший ответ для {url} ({data['error']})")
+            tracing.annotate(fallback="stale", error=data["error"][:120])
+            return stale
+    return data
+
+
+async def fetch_movies_by_genre(session: aiohttp.ClientSession, genre_name: str, page: int = 1, refresh: bool = False) -> dict:
     genre_id = GENRES.get(genre_name)
     if genre_id is None:
         return {"error": "Неверный жанр."}
@@ -52,31 +277,31 @@ async def fetch_movies_by_genre(session: aiohttp.ClientSession, genre_name: str,
         "primary_release_date.gte": f"{datetime.now().year - 10}-01-01",
         "page": page
     }
-    return await fetch(session, url, params)
+    return await fetch(session, url, params, refresh)
 
 
-async def fetch_top_movies(session: aiohttp.ClientSession, page: int = 1) -> dict:
+async def fetch_top_movies(session: aiohttp.ClientSession, page: int = 1, refresh: bool = False) -> dict:
     url = f"{BASE_URL}/movie/top_rated"
     params = {
         **base_params(),
         "page": page
     }
-    return await fetch(session, url, params)
+    return await fetch(session, url, params, refresh)
 
 
-async def fetch_recommendations(session: aiohttp.ClientSession) -> dict:
+async def fetch_recommendations(session: aiohttp.ClientSession, refresh: bool = False) -> dict:
     url = f"{BASE_URL}/trending/movie/week"
     params = base_params()
-    return await fetch(session, url, params)
+    return await fetch(session, url, params, refresh)
 
 
-async def fetch_new_movies(session: aiohttp.ClientSession, page: int = 1) -> dict:
+async def fetch_new_movies(session: aiohttp.ClientSession, page: int = 1, refresh: bool = False) -> dict:
     url = f"{BASE_URL}/movie/now_playing"
     params = {
         **base_params(),
         "page": page
     }
-    return await fetch(session, url, params)
+    return await fetch(session, url, params, refresh)
 
 
 async def search_movies_by_keyword(session: aiohttp.ClientSession, query: str, page: int = 1) -> dict:
@@ -89,21 +314,75 @@ async def search_movies_by_keyword(session: aiohttp.ClientSession, query: str, p
     }
     return await fetch(session, url, params)
 
-async def send_movie_preview(bot: Bot, chat_id: int, movie: dict):
-    movie_id = movie.get("id")
-    title = movie.get("title", "Без названия")
-    release = movie.get("release_date", "неизвестно")[:4]
-    overview = movie.get("overview", "Описание отсутствует")
-    poster_path = movie.get("poster_path")
 
-    caption = f"<b>{title}</b> ({release})\n{overview[:300]}..."
+async def fetch_movie_details(session: aiohttp.ClientSession, movie_id: int) -> dict:
+    url = f"{BASE_URL}/movie/{movie_id}"
+    return await fetch(session, url, base_params())
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="⭐ В избранное", callback_data=f"fav_{movie_id}")
-    ]])
 
-    if poster_path:
-        poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}"
-        await bot.send_photo(chat_id, photo=poster_url, caption=caption, parse_mode="HTML", reply_markup=keyboard)
-    else:
-        await bot.send_message(chat_id, text=caption, parse_mode="HTML", reply_markup=keyboard)
\ No newline at end of file
+class TmdbClient:
+    """Долгоживущий клиент TMDB с общим пулом keep-alive соединений."""
+
+    def __init__(
+        self,
+        limit: int = TMDB_LIMIT,
+        limit_per_host: int = TMDB_LIMIT_PER_HOST,
+        keepalive_timeout: float = TMDB_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl: int = TMDB_DNS_CACHE_TTL,
+        total_timeout: float = TMDB_TOTAL_TIMEOUT,
+        connect_timeout: float = TMDB_CONNECT_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        """Создаёт пул соединений. Вызывается при старте бота."""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        logger.info("TMDB: пул соединений создан (limit=%s, per_host=%s)", self.limit, self.limit_per_host)
+
+    async def close(self) -> None:
+        """Закрывает пул соединений. Вызывается при остановке бота."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("TmdbClient не запущен: вызовите await tmdb.start().")
+        return self._session
+
+    async def movies_by_genre(self, genre_name: str, page: int = 1, refresh: bool = False) -> dict:
+        return await fetch_movies_by_genre(self.session, genre_name, page, refresh)
+
+    async def top_movies(self, page: int = 1, refresh: bool = False) -> dict:
+        return await fetch_top_movies(self.session, page, refresh)
+
+    async def recommendations(self, refresh: bool = False) -> dict:
+        return await fetch_recommendations(self.session, refresh)
+
+    async def new_movies(self, page: int = 1, refresh: bool = False) -> dict:
+        return await fetch_new_movies(self.session, page, refresh)
+
+    async def search(self, query: str, page: int = 1) -> dict:
+        return await search_movies_by_keyword(self.session, query, page)
+
+    async def movie_details(self, movie_id: int) -> dict:
+        return await fetch_movie_details(self.session, movie_id)
+
+
+# Общий клиент TMDB для всего процесса
+tmdb = TmdbClient()
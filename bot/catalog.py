@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from bot.api_tmdb import tmdb, add_results_hook
+from bot.config import CATALOG_REFRESH_AFTER
+from bot.database.db import async_session
+from bot.database.crud import upsert_movies, get_movie
+from bot.database.models import Movie
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks: set[asyncio.Task] = set()
+# Фильмы, обновление которых уже запущено
+_refreshing: set[int] = set()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def save_movies(movies: list[dict]) -> None:
+    """Сохраняет фильмы из ответа TMDB в каталог."""
+    try:
+        async with async_session() as session:
+            await upsert_movies(session, movies)
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении фильмов в каталог: {e}")
+
+
+def remember_movies(movies: list[dict]) -> None:
+    """Фоново сохраняет фильмы в каталог, не задерживая ответ пользователю."""
+    _spawn(save_movies(movies))
+
+
+async def refresh_movie(movie_id: int, session: Optional[AsyncSession] = None) -> Optional[Movie]:
+    """Загружает карточку фильма из TMDB и обновляет её в каталоге.
+
+    В чужой сессии (сессии обновления) только выполняет upsert — commit за её владельцем.
+    """
+    data = await tmdb.movie_details(movie_id)
+    if "error" in data or not data.get("id"):
+        return None
+    if session is not None:
+        await upsert_movies(session, [data])
+        return await session.get(Movie, movie_id, populate_existing=True)
+    async with async_session() as own_session:
+        await upsert_movies(own_session, [data])
+        await own_session.commit()
+        return await get_movie(own_session, movie_id)
+
+
+async def _background_refresh(movie_id: int) -> None:
+    _refreshing.add(movie_id)
+    try:
+        await refresh_movie(movie_id)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении фильма {movie_id} в каталоге: {e}")
+    finally:
+        _refreshing.discard(movie_id)
+
+
+def _is_stale(movie: Movie) -> bool:
+    updated_at = movie.updated_at
+    if updated_at is None:
+        return True
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - updated_at > timedelta(seconds=CATALOG_REFRESH_AFTER)
+
+
+async def get_movie_details(movie_id: int, session: Optional[AsyncSession] = None) -> Optional[Movie]:
+    """Карточка фильма из каталога; устаревшая обновляется в фоне, отсутствующая — из TMDB.
+
+    None — фильма нет ни в каталоге, ни в TMDB, или TMDB сейчас недоступен.
+    """
+    if session is not None:
+        movie = await get_movie(session, movie_id)
+    else:
+        async with async_session() as own_session:
+            movie = await get_movie(own_session, movie_id)
+
+    if movie is None:
+        try:
+            return await refresh_movie(movie_id, session)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить фильм {movie_id} из TMDB: {e}")
+            return None
+
+    if _is_stale(movie) and movie_id not in _refreshing:
+        _spawn(_background_refresh(movie_id))
+    return movie
+
+
+add_results_hook(remember_movies)
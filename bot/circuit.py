@@ -0,0 +1,63 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Размыкатель: после failure_threshold сбоев подряд запросы не выполняются reset_timeout секунд.
+
+    Затем пропускается один пробный запрос: успех замыкает цепь, сбой снова её размыкает.
+    Если результат пробного запроса не пришёл за probe_timeout секунд, цепь снова размыкается.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, probe_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == HALF_OPEN and now - self._probe_started >= self.probe_timeout:
+            logger.warning(f"{self.name}: пробный запрос не завершился за {self.probe_timeout:.0f} с, цепь разомкнута")
+            self.state = OPEN
+            self._opened_at = now
+        if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN  # пробный запрос
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logger.info(f"{self.name}: цепь замкнута, сервис снова отвечает")
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"{self.name}: цепь разомкнута на {self.reset_timeout:.0f} с после {self.failures} сбоев")
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Пробный запрос отменён, не дойдя до результата: следующий запрос станет новым пробным."""
+        if self.state == HALF_OPEN:
+            self.state = OPEN
+            self._opened_at = time.monotonic() - self.reset_timeout
@@ -11,7 +11,122 @@ def get_env_variable(key: str, default: str = None, required: bool = True) -> st
         raise EnvironmentError(f"Обязательная переменная окружения '{key}' не найдена.")
     return value
 
+# Необязательные числовые и логические параметры
+def get_env_int(key: str, default: int) -> int:
+    return int(get_env_variable(key, str(default), required=False))
+
+def get_env_float(key: str, default: float) -> float:
+    return float(get_env_variable(key, str(default), required=False))
+
+def get_env_bool(key: str, default: bool) -> bool:
+    return get_env_variable(key, str(default), required=False).lower() in ("1", "true", "yes")
+
 # Получение значений токенов и ключей
 TELEGRAM_API_TOKEN = get_env_variable("TELEGRAM_API_TOKEN")
 TMDB_API_KEY = get_env_variable("TMDB_API_KEY")
-DATABASE_URL = get_env_variable("DATABASE_URL")
\ No newline at end of file
+DATABASE_URL = get_env_variable("DATABASE_URL")
+
+# Адреса внешних API (переопределяются для локального Bot API сервера и стендов нагрузочного тестирования)
+TELEGRAM_API_URL = get_env_variable("TELEGRAM_API_URL", "", required=False)
+TMDB_BASE_URL = get_env_variable("TMDB_BASE_URL", "https://api.themoviedb.org/3", required=False)
+
+# Пул соединений к TMDB
+TMDB_LIMIT = get_env_int("TMDB_LIMIT", 100)                        # всего соединений
+TMDB_LIMIT_PER_HOST = get_env_int("TMDB_LIMIT_PER_HOST", 30)       # соединений на хост
+TMDB_KEEPALIVE_TIMEOUT = get_env_float("TMDB_KEEPALIVE_TIMEOUT", 30.0)
+TMDB_DNS_CACHE_TTL = get_env_int("TMDB_DNS_CACHE_TTL", 300)
+TMDB_TOTAL_TIMEOUT = get_env_float("TMDB_TOTAL_TIMEOUT", 10.0)
+TMDB_CONNECT_TIMEOUT = get_env_float("TMDB_CONNECT_TIMEOUT", 3.0)
+
+# Устойчивость к сбоям TMDB
+TMDB_RATE = get_env_float("TMDB_RATE", 40.0)                       # запросов в секунду (лимит TMDB ~50)
+TMDB_BURST = get_env_int("TMDB_BURST", 20)
+TMDB_RETRIES = get_env_int("TMDB_RETRIES", 2)                      # повторов после первой попытки
+TMDB_RETRY_BASE_DELAY = get_env_float("TMDB_RETRY_BASE_DELAY", 0.5)
+TMDB_RETRY_MAX_DELAY = get_env_float("TMDB_RETRY_MAX_DELAY", 5.0)  # дольше ждать не будем, даже если просит Retry-After
+TMDB_BREAKER_THRESHOLD = get_env_int("TMDB_BREAKER_THRESHOLD", 5)  # неудачных запросов подряд до размыкания
+TMDB_BREAKER_RESET = get_env_float("TMDB_BREAKER_RESET", 30.0)     # секунд до пробного запроса
+TMDB_BREAKER_PROBE_TIMEOUT = get_env_float("TMDB_BREAKER_PROBE_TIMEOUT", 60.0)  # сколько ждать исхода пробного запроса
+TMDB_STALE_TTL = get_env_int("TMDB_STALE_TTL", 24 * 3600)          # сколько отдавать устаревший ответ, пока TMDB недоступен
+
+# Кэш ответов TMDB
+TMDB_CACHE_SIZE = get_env_int("TMDB_CACHE_SIZE", 2048)             # записей в LRU
+
+# Каталог фильмов: через сколько секунд локальная карточка считается устаревшей
+CATALOG_REFRESH_AFTER = get_env_int("CATALOG_REFRESH_AFTER", 24 * 3600)
+
+# Кэш file_id постеров в памяти
+POSTER_CACHE_SIZE = get_env_int("POSTER_CACHE_SIZE", 10000)
+
+# Вывод списков фильмов: album — один альбом и одно сообщение с кнопками, cards — карточка на фильм
+LIST_RENDER_MODE = get_env_variable("LIST_RENDER_MODE", "album", required=False)
+CARD_CACHE_SIZE = get_env_int("CARD_CACHE_SIZE", 4096)             # готовых карточек фильмов в памяти
+PREFETCH_CONCURRENCY = get_env_int("PREFETCH_CONCURRENCY", 8)     # фоновых загрузок следующей страницы (0 — выключено)
+
+# Рассылка уведомлений
+BROADCAST_RATE = get_env_float("BROADCAST_RATE", 30.0)             # сообщений в секунду на бота
+BROADCAST_CONCURRENCY = get_env_int("BROADCAST_CONCURRENCY", 20)   # одновременных отправок
+BROADCAST_BATCH_SIZE = get_env_int("BROADCAST_BATCH_SIZE", 1000)   # пользователей за один запрос к БД
+OUTBOX_CLAIM_SIZE = get_env_int("OUTBOX_CLAIM_SIZE", 100)          # строк outbox за один захват
+OUTBOX_LEASE_SECONDS = get_env_int("OUTBOX_LEASE_SECONDS", 300)    # через сколько захват считается брошенным
+# Как часто досылать прерванные рассылки; должно быть чаще, чем истекает захват
+OUTBOX_RESUME_INTERVAL = get_env_int("OUTBOX_RESUME_INTERVAL", max(30, OUTBOX_LEASE_SECONDS // 2))
+# Ежедневная рассылка новинок — в одно и то же время на всех экземплярах (часовой пояс планировщика)
+NOTIFY_HOUR = get_env_int("NOTIFY_HOUR", 10)
+NOTIFY_MINUTE = get_env_int("NOTIFY_MINUTE", 0)
+
+# Хранилище состояния (FSM, пагинация): memory — в процессе, redis — общее для всех воркеров
+STATE_BACKEND = get_env_variable("STATE_BACKEND", "memory", required=False)
+REDIS_URL = get_env_variable("REDIS_URL", "redis://localhost:6379/0", required=False)
+STATE_TTL = get_env_int("STATE_TTL", 24 * 3600)                    # время жизни записи, секунд
+STATE_MAX_ENTRIES = get_env_int("STATE_MAX_ENTRIES", 100000)       # предел записей в памяти
+
+# Ограничение частоты входящих обновлений (token bucket)
+THROTTLE_USER_RATE = get_env_float("THROTTLE_USER_RATE", 2.0)      # обновлений в секунду на пользователя
+THROTTLE_USER_BURST = get_env_int("THROTTLE_USER_BURST", 6)
+THROTTLE_SHARED = get_env_bool("THROTTLE_SHARED", False)           # хранить корзины в общем хранилище состояния
+THROTTLE_ENABLED = get_env_bool("THROTTLE_ENABLED", True)
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = get_env_variable("BOT_MODE", "polling", required=False)
+WEBHOOK_URL = get_env_variable("WEBHOOK_URL", None, required=False)          # публичный адрес за балансировщиком
+WEBHOOK_PATH = get_env_variable("WEBHOOK_PATH", "/webhook", required=False)
+WEBHOOK_SECRET = get_env_variable("WEBHOOK_SECRET", None, required=False)
+WEBHOOK_HOST = get_env_variable("WEBHOOK_HOST", "0.0.0.0", required=False)
+WEBHOOK_PORT = get_env_int("WEBHOOK_PORT", 8080)
+WEBHOOK_MAX_CONNECTIONS = get_env_int("WEBHOOK_MAX_CONNECTIONS", 40)
+UPDATE_WORKERS = get_env_int("UPDATE_WORKERS", 32)                 # одновременно обрабатываемых обновлений
+
+# Многопроцессный режим: число процессов-обработчиков (0 или 1 — один процесс)
+SHARD_WORKERS = get_env_int("SHARD_WORKERS", 0)
+SHARD_QUEUE_SIZE = get_env_int("SHARD_QUEUE_SIZE", 1000)           # очередь обновлений на процесс
+TMDB_SHARED_CACHE = get_env_bool("TMDB_SHARED_CACHE", False)       # второй уровень кэша TMDB в хранилище состояния
+
+# Прогрев кэша TMDB: общие ленты обновляются за CACHE_WARM_LEAD секунд до истечения TTL
+CACHE_WARM_ENABLED = get_env_bool("CACHE_WARM_ENABLED", True)
+CACHE_WARM_LEAD = get_env_int("CACHE_WARM_LEAD", 300)
+CACHE_WARM_JITTER = get_env_int("CACHE_WARM_JITTER", 120)          # случайный сдвиг запуска, чтобы экземпляры не били в TMDB разом
+CACHE_WARM_CONCURRENCY = get_env_int("CACHE_WARM_CONCURRENCY", 4)
+
+# Кэш избранного: shared — в общем хранилище состояния (инвалидация видна всем воркерам)
+FAVORITES_CACHE_TTL = get_env_int("FAVORITES_CACHE_TTL", 600)
+FAVORITES_CACHE_SIZE = get_env_int("FAVORITES_CACHE_SIZE", 50000)
+FAVORITES_CACHE_SHARED = get_env_bool("FAVORITES_CACHE_SHARED", False)
+
+# Метрики Prometheus: в режиме webhook /metrics отдаёт webhook-сервер, иначе — отдельный (0 — выключен)
+METRICS_HOST = get_env_variable("METRICS_HOST", "0.0.0.0", required=False)
+METRICS_PORT = get_env_int("METRICS_PORT", 9100)
+
+# Трассировка обновлений: медленные (дольше TRACE_SLOW_MS) логируются и пишутся в TRACE_FILE всегда;
+# TRACE_ENABLED включает выборочную запись остальных — с вероятностью TRACE_SAMPLE_RATE
+TRACE_ENABLED = get_env_bool("TRACE_ENABLED", False)
+TRACE_FILE = get_env_variable("TRACE_FILE", "traces.jsonl", required=False)
+TRACE_MAX_BYTES = get_env_int("TRACE_MAX_BYTES", 50 * 2 ** 20)  # при превышении файл переименовывается в .1
+TRACE_SLOW_MS = get_env_float("TRACE_SLOW_MS", 2000.0)
+TRACE_SAMPLE_RATE = get_env_float("TRACE_SAMPLE_RATE", 0.0)
+
+# Администраторы (telegram_id через запятую) и профилировщик для них
+ADMIN_IDS = {int(value) for value in get_env_variable("ADMIN_IDS", "", required=False).split(",") if value.strip()}
+PROFILE_DIR = get_env_variable("PROFILE_DIR", "profiles", required=False)
+PROFILE_INTERVAL_MS = get_env_float("PROFILE_INTERVAL_MS", 5.0)
+PROFILE_MAX_SECONDS = get_env_int("PROFILE_MAX_SECONDS", 300)
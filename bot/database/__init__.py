@@ -1 +1 @@
-from .db import async_session, init_db
\ No newline at end of file
+from .db import async_session, init_db, get_pool_status
\ No newline at end of file
@@ -1,9 +1,17 @@
-from bot.database.models import User, Favorite
+from bot.database.models import User, Favorite, Movie, PosterFile
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import Optional
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, func, delete, literal, literal_column, exists, event
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import insert
+from typing import Optional, Iterable
+from bot.cache import TTLCache
+from bot.config import FAVORITES_CACHE_TTL, FAVORITES_CACHE_SIZE, FAVORITES_CACHE_SHARED
+from bot.storage import MemoryStateStore, state_store
+import asyncio
+import enum
 import logging
+import time
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
@@ -21,83 +29,288 @@ console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
 MAX_FAVORITES = 10  # 🔢 Максимальное количество избранных фильмов
+KNOWN_USERS_CACHE_SIZE = 100_000  # 👥 Пользователей в кэше telegram_id → users.id
 
-# Получить или создать пользователя с избранными фильмами
-async def get_or_create_user_with_favorites(session: AsyncSession, telegram_id: int, username: Optional[str] = None) -> User:
-    result = await session.execute(
-        select(User)
-        .filter_by(telegram_id=telegram_id)
-        .options(selectinload(User.favorites))  # загружаем избранные фильмы
+# Функции этого модуля не делают commit: транзакцией управляет владелец сессии
+# (DbSessionMiddleware для обработчиков обновлений).
+
+# Пользователи, уже загруженные в этой сессии (одна сессия — одно обновление Telegram)
+def _identity_map(session: AsyncSession) -> dict[int, User]:
+    return session.info.setdefault("users", {})
+
+# Кэш telegram_id → (users.id, username): обычный путь определения пользователя без запросов к БД
+known_users = TTLCache(maxsize=KNOWN_USERS_CACHE_SIZE, ttl=24 * 3600)
+# Новые username, которые ещё не записаны в БД: users.id → username
+_pending_usernames: dict[int, str] = {}
+
+# id пользователя по telegram_id; новый пользователь создаётся одним upsert
+async def resolve_user_id(session: AsyncSession, telegram_id: int, username: Optional[str] = None) -> int:
+    username = username or None
+    cached = known_users.get(telegram_id) or session.info.get("new_users", {}).get(telegram_id)
+    if cached is not None:
+        user_id, known_username = cached
+        if username is not None and username != known_username:
+            # Смена username не срочная — запишется пачкой в flush_pending_usernames
+            _pending_usernames[user_id] = username
+            known_users.set(telegram_id, (user_id, username))
+        return user_id
+
+    stmt = insert(User).values(telegram_id=telegram_id, username=username)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={"username": func.coalesce(stmt.excluded.username, User.username)},
+    ).returning(User.id, User.username, literal_column("xmax = 0").label("inserted"))
+    row = (await session.execute(stmt)).one()
+    if row.inserted:
+        # Новую строку кэшируем только после commit — при откате её не станет
+        session.info.setdefault("new_users", {})[telegram_id] = (row.id, row.username)
+    else:
+        known_users.set(telegram_id, (row.id, row.username))
+    return row.id
+
+@event.listens_for(Session, "after_commit")
+def _remember_new_users(session: Session) -> None:
+    for telegram_id, entry in session.info.pop("new_users", {}).items():
+        known_users.set(telegram_id, entry)
+
+# after_rollback срабатывает и на откат savepoint (begin_nested в add_favorite) — он не отменяет внешнюю транзакцию
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_new_users(session: Session, previous_transaction) -> None:
+    if not previous_transaction.nested:
+        session.info.pop("new_users", None)
+
+# Записать накопившиеся смены username одним пакетным UPDATE
+async def flush_pending_usernames(session: AsyncSession) -> int:
+    if not _pending_usernames:
+        return 0
+    rows = [{"id": user_id, "username": username} for user_id, username in _pending_usernames.items()]
+    _pending_usernames.clear()
+    await session.execute(update(User), rows)
+    return len(rows)
+
+class FavoriteResult(enum.Enum):
+    """Итог добавления фильма в избранное."""
+    ADDED = "added"
+    DUPLICATE = "duplicate"
+    LIMIT_REACHED = "limit_reached"
+    ERROR = "error"
+
+def _insert_favorite(user_id: int, movie_id: int):
+    # Свободная ячейка с наименьшим номером; если свободных нет — вставлять нечего
+    slots = func.generate_series(0, MAX_FAVORITES - 1).table_valued("value").render_derived(name="slots")
+    taken = select(Favorite.slot).where(Favorite.user_id == user_id)
+    free_slot = (
+        select(literal(user_id), literal(movie_id), slots.c.value)
+        .where(slots.c.value.not_in(taken))
+        .order_by(slots.c.value)
+        .limit(1)
+    )
+    return (
+        insert(Favorite)
+        .from_select(["user_id", "movie_id", "slot"], free_slot)
+        .on_conflict_do_nothing()
+        .returning(Favorite.id)
     )
-    user = result.scalar_one_or_none()  # гарантирует, что будет только один результат, или None
-    if not user:
-        user = User(telegram_id=telegram_id, username=username)
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
-    return user
 
-# Добавить фильм в избранное (если ещё не добавлен и не превышен лимит)
-async def add_favorite(session: AsyncSession, user: User, movie_data: dict) -> str:
+# Добавить фильм в избранное одним запросом: INSERT ... ON CONFLICT DO NOTHING в свободную ячейку.
+# Фильм должен уже быть в каталоге movies.
+async def add_favorite(session: AsyncSession, user_id: int, movie_id: int) -> FavoriteResult:
     try:
-        # Обновление информации о пользователе для актуальности данных
-        await session.refresh(user, attribute_names=["favorites"])
-
-        # Проверка на лимит
-        if len(user.favorites) >= MAX_FAVORITES:
-            return "Достигнут лимит избранных фильмов."
-
-        # Проверка на существование фильма
-        movie_exists = await session.scalar(select(Favorite).filter_by(
-            user_id=user.id,
-            movie_id=movie_data["id"]
-        ))
-        if movie_exists:
-            return "Этот фильм уже в избранном."
-
-        # Создание объекта фильма для добавления
-        favorite = Favorite(
-            user_id=user.id,
-            movie_id=movie_data["id"],
-            movie_title=movie_data["title"],
-            movie_overview=movie_data.get("overview", ""),
-            poster_url=movie_data.get("poster") or None  # Если нет poster, ставим None
-        )
-
-        # Добавление фильма в сессию
-        session.add(favorite)
-        await session.commit()
-
-        return "Фильм успешно добавлен в избранное."
-
-    except Exception as e:
-        # Логируем ошибку
-        logger.error(f"Ошибка при добавлении фильма {movie_data['title']} в избранное: {str(e)}")
-        await session.rollback()  # Откат изменений в случае ошибки
-        return "Ошибка при добавлении фильма в избранное. Повторите попытку."
-
-
-# Удаление фильма из избранного
-async def remove_favorite(session: AsyncSession, user: User, movie_id: int) -> bool:
-    result = await session.execute(
-        select(Favorite).filter_by(user_id=user.id, movie_id=movie_id)
+        # Вторая попытка нужна, только если параллельная вставка заняла ту же ячейку
+        for _ in range(2):
+            # Точка сохранения: ошибка откатывает только эту попытку, а не всю транзакцию обновления
+            async with session.begin_nested():
+                inserted = await session.scalar(_insert_favorite(user_id, movie_id))
+                if inserted is None:
+                    # Запрос ничего не вставил — выясняем почему
+                    duplicate, count = (await session.execute(
+                        select(
+                            exists().where(Favorite.user_id == user_id, Favorite.movie_id == movie_id),
+                            select(func.count()).select_from(Favorite).where(Favorite.user_id == user_id).scalar_subquery(),
+                        )
+                    )).one()
+            if inserted is not None:
+                _mark_favorites_changed(session, user_id)
+                return FavoriteResult.ADDED
+            if duplicate:
+                return FavoriteResult.DUPLICATE
+            if count >= MAX_FAVORITES:
+                return FavoriteResult.LIMIT_REACHED
+        return FavoriteResult.ERROR
+
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка при добавлении фильма {movie_id} в избранное: {str(e)}")
+        return FavoriteResult.ERROR
+
+
+# Удаление фильма из избранного одним DELETE ... RETURNING; возвращает название удалённого фильма
+async def remove_favorite(session: AsyncSession, user_id: int, movie_id: int) -> Optional[str]:
+    title = await session.scalar(
+        delete(Favorite)
+        .where(Favorite.user_id == user_id, Favorite.movie_id == movie_id, Favorite.movie_id == Movie.id)
+        .returning(Movie.title)
+    )
+    if title is not None:
+        _mark_favorites_changed(session, user_id)
+    return title
+
+# Получить список избранных фильмов пользователя вместе с фильмами из каталога (один запрос)
+async def get_favorites(session: AsyncSession, user_id: int) -> list[Favorite]:
+    result = await session.scalars(
+        select(Favorite).filter_by(user_id=user_id).order_by(Favorite.id)
     )
-    favorite = result.scalar_one_or_none()
+    return list(result.unique())
+
+# Кэш избранного: users.id → список фильмов (словари, как в ответе TMDB)
+favorites_cache = state_store if FAVORITES_CACHE_SHARED else MemoryStateStore(FAVORITES_CACHE_SIZE, FAVORITES_CACHE_TTL)
+# Версии — в отдельном хранилище: вытеснение записей со списками не вытесняет версии
+favorites_versions = state_store if FAVORITES_CACHE_SHARED else MemoryStateStore(FAVORITES_CACHE_SIZE, FAVORITES_CACHE_TTL * 2)
+# Версии, ещё не записанные в хранилище: в этом процессе они действуют сразу после commit
+_pending_versions: dict[int, int] = {}
+VERSION_PUBLISH_ATTEMPTS = 3
+
+def _favorites_key(user_id: int) -> str:
+    return f"favorites:{user_id}"
 
-    if not favorite:
-        return False  # Фильм не найден
+def _version_key(user_id: int) -> str:
+    return f"favorites_version:{user_id}"
 
-    await session.delete(favorite)
-    await session.commit()
-    return True
+# Пока транзакция с изменением избранного не завершена, кэш этого пользователя не читается и не заполняется
+def _mark_favorites_changed(session: AsyncSession, user_id: int) -> None:
+    session.info.setdefault("changed_favorites", set()).add(user_id)
 
-# Получить список избранных фильмов пользователя
-async def get_favorites(session: AsyncSession, user: User) -> list[Favorite]:
-    await session.refresh(user, attribute_names=["favorites"])
-    return user.favorites
+async def _publish_version(user_id: int, version: int) -> None:
+    for attempt in range(VERSION_PUBLISH_ATTEMPTS):
+        try:
+            # Версия живёт дольше записи: пропавшая версия всё равно не совпадёт с версией записи
+            await favorites_versions.set(_version_key(user_id), version, FAVORITES_CACHE_TTL * 2)
+        except Exception as e:
+            logger.warning(f"Не удалось записать версию избранного {user_id} (попытка {attempt + 1}): {e}")
+            await asyncio.sleep(0.1 * 2 ** attempt)
+            continue
+        if _pending_versions.get(user_id) == version:
+            del _pending_versions[user_id]
+        return
+    # Этот процесс продолжает видеть версию через _pending_versions; другие — до истечения TTL записи
+    logger.error(f"Версия избранного {user_id} не записана: другие процессы могут видеть старый список")
+
+async def publish_favorites_versions(session: AsyncSession) -> None:
+    """Записывает версии избранного, изменённого в закоммиченной транзакции; вызывается после commit."""
+    versions = session.info.pop("favorites_versions", {})
+    if versions:
+        await asyncio.gather(*(_publish_version(user_id, version) for user_id, version in versions.items()))
+
+async def _current_version(user_id: int) -> int:
+    pending = _pending_versions.get(user_id)
+    if pending is not None:
+        return pending
+    version = await favorites_versions.get(_version_key(user_id))
+    if version is None:
+        # Версии нет (ещё не было изменений или её вытеснили) — заводим новую: старые записи
+        # с ней не совпадут. Перезаписать опубликованную версию так нельзя во вред: раз её
+        # уже записали, commit прошёл, и запрос к БД после этого вернёт новые данные
+        version = time.time_ns()
+        await favorites_versions.set(_version_key(user_id), version, FAVORITES_CACHE_TTL * 2)
+    return version
+
+# Запись кэша помечена версией, прочитанной до запроса к БД. Commit меняет версию, поэтому запись,
+# собранная по данным до commit, уже не совпадёт с текущей версией, даже если её запишут позже
+@event.listens_for(Session, "after_commit")
+def _invalidate_favorites(session: Session) -> None:
+    versions = session.info.setdefault("favorites_versions", {})
+    for user_id in session.info.pop("changed_favorites", ()):
+        versions[user_id] = _pending_versions[user_id] = time.time_ns()
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_favorites_changes(session: Session, previous_transaction) -> None:
+    if not previous_transaction.nested:
+        session.info.pop("changed_favorites", None)
+
+# Избранные фильмы пользователя через кэш (read-through)
+async def get_favorite_movies(session: AsyncSession, user_id: int) -> list[dict]:
+    changed = user_id in session.info.get("changed_favorites", ())
+    key = _favorites_key(user_id)
+    version = None
+    if not changed:
+        version = await _current_version(user_id)
+        cached = await favorites_cache.get(key)
+        if cached is not None and cached["version"] == version:
+            return cached["movies"]
+
+    movies = [favorite.movie.to_dict() for favorite in await get_favorites(session, user_id)]
+    if not changed:
+        await favorites_cache.set(key, {"version": version, "movies": movies}, FAVORITES_CACHE_TTL)
+    return movies
+
+# Сохранить или обновить фильмы из ответа TMDB в каталоге
+async def upsert_movies(session: AsyncSession, movies: Iterable[dict]) -> int:
+    rows = {}
+    for movie in movies:
+        if not movie.get("id") or not movie.get("title"):
+            continue
+        rows[movie["id"]] = {
+            "id": movie["id"],
+            "title": movie["title"],
+            "original_title": movie.get("original_title"),
+            "overview": movie.get("overview") or None,
+            "poster_path": movie.get("poster_path"),
+            "release_date": movie.get("release_date") or None,
+            "popularity": movie.get("popularity"),
+            "vote_average": movie.get("vote_average"),
+        }
+    if not rows:
+        return 0
+
+    stmt = insert(Movie).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Movie.id],
+        set_={
+            "title": stmt.excluded.title,
+            "original_title": stmt.excluded.original_title,
+            "overview": stmt.excluded.overview,
+            "poster_path": stmt.excluded.poster_path,
+            "release_date": stmt.excluded.release_date,
+            "popularity": stmt.excluded.popularity,
+            "vote_average": stmt.excluded.vote_average,
+            "updated_at": func.now(),
+        },
+    )
+    await session.execute(stmt)
+    return len(rows)
+
+async def get_movie(session: AsyncSession, movie_id: int) -> Optional[Movie]:
+    return await session.get(Movie, movie_id)
 
 async def get_user_by_id(session: AsyncSession, telegram_id: int):
+    users = _identity_map(session)
+    if telegram_id in users:
+        return users[telegram_id]
     result = await session.execute(
         select(User).filter_by(telegram_id=telegram_id)
     )
-    return result.scalar_one_or_none()
\ No newline at end of file
+    user = result.scalar_one_or_none()
+    if user is not None:
+        users[telegram_id] = user
+    return user
+
+async def get_poster_file_id(session: AsyncSession, poster_path: str) -> Optional[str]:
+    return await session.scalar(
+        select(PosterFile.file_id).filter_by(poster_path=poster_path)
+    )
+
+async def get_poster_file_ids(session: AsyncSession, poster_paths: Iterable[str]) -> dict[str, str]:
+    result = await session.execute(
+        select(PosterFile.poster_path, PosterFile.file_id).where(PosterFile.poster_path.in_(list(poster_paths)))
+    )
+    return dict(result.tuples().all())
+
+async def save_poster_file_id(session: AsyncSession, poster_path: str, file_id: str) -> None:
+    stmt = insert(PosterFile).values(poster_path=poster_path, file_id=file_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PosterFile.poster_path],
+        set_={"file_id": stmt.excluded.file_id, "updated_at": func.now()},
+    )
+    await session.execute(stmt)
+
+async def delete_poster_file_id(session: AsyncSession, poster_path: str) -> None:
+    await session.execute(delete(PosterFile).filter_by(poster_path=poster_path))
@@ -1,8 +1,14 @@
 import os
+import time
 
 from dotenv import load_dotenv
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from bot.database.pool import InstrumentedAsyncPool, pool_status
+from bot.database.migrations import MIGRATIONS
+from bot.metrics import DB_QUERY_SECONDS, statement_label
+from bot import tracing
 
 # Загрузка переменных из .env
 load_dotenv()
@@ -18,13 +24,62 @@ Base = declarative_base()
 # Определение, будет ли логироваться SQL-запросы в зависимости от окружения
 SQL_ECHO = os.getenv("SQL_ECHO", "False").lower() == "true"
 
+# Параметры пула соединений (подбираются под число воркеров и PgBouncer)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+
+# Кэши подготовленных выражений asyncpg; для PgBouncer в режиме transaction оба ставят в 0
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "100"))
+
+connect_args = {}
+if "+asyncpg" in DATABASE_URL:
+    connect_args = {
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE,
+    }
+
 # Создание движка
-engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=SQL_ECHO,
+    poolclass=InstrumentedAsyncPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args=connect_args,
+)
+
+# Время SQL-запросов: начало запоминается в соединении (запросы в нём идут по одному)
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        label = statement_label(statement)
+        DB_QUERY_SECONDS.labels(label).observe(elapsed)
+        # Событие вызывается в greenlet того же asyncio-задания — контекст трассы доступен
+        tracing.record("sql", started, elapsed, statement=label, sql=" ".join(statement.split())[:120])
 
 # Фабрика асинхронных сессий
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
-# Инициализация базы данных (создание таблиц)
+# Инициализация базы данных (создание таблиц и обновление схемы существующих)
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        for statement in MIGRATIONS:
+            await conn.execute(text(statement))
+
+# Состояние пула соединений: занятые, переполнение, ожидание соединения
+def get_pool_status() -> dict:
+    return pool_status(engine.pool)
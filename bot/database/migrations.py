@@ -0,0 +1,54 @@
+# Изменения схемы для баз, созданных до появления каталога фильмов и ячеек избранного.
+# create_all не меняет существующие таблицы, поэтому init_db после него выполняет эти
+# операторы по порядку. Каждый идемпотентен: на новой или уже обновлённой базе ничего не делает.
+MIGRATIONS = (
+    # Фильмы из старых строк избранного переносятся в каталог до удаления колонок
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'favorites' AND column_name = 'movie_title'
+        ) THEN
+            INSERT INTO movies (id, title, overview, poster_path)
+            SELECT DISTINCT ON (movie_id)
+                movie_id, movie_title, movie_overview,
+                regexp_replace(poster_url, '^https?://[^/]+/t/p/[^/]+', '')
+            FROM favorites
+            ORDER BY movie_id, id DESC
+            ON CONFLICT (id) DO NOTHING;
+        END IF;
+    END $$
+    """,
+    "ALTER TABLE favorites DROP COLUMN IF EXISTS movie_title, "
+    "DROP COLUMN IF EXISTS movie_overview, DROP COLUMN IF EXISTS poster_url",
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'favorites_movie_id_fkey') THEN
+            ALTER TABLE favorites
+                ADD CONSTRAINT favorites_movie_id_fkey FOREIGN KEY (movie_id) REFERENCES movies (id);
+        END IF;
+    END $$
+    """,
+    # Ячейки избранного: существующие строки получают номера по порядку добавления
+    "ALTER TABLE favorites ADD COLUMN IF NOT EXISTS slot SMALLINT",
+    """
+    UPDATE favorites AS f SET slot = numbered.slot
+    FROM (SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY id) - 1 AS slot FROM favorites) AS numbered
+    WHERE f.id = numbered.id AND f.slot IS NULL
+    """,
+    "ALTER TABLE favorites ALTER COLUMN slot SET NOT NULL",
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_user_slot') THEN
+            ALTER TABLE favorites ADD CONSTRAINT uq_user_slot UNIQUE (user_id, slot);
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ck_favorite_slot') THEN
+            ALTER TABLE favorites ADD CONSTRAINT ck_favorite_slot CHECK (slot >= 0);
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_users_notifications_id ON users (id) WHERE receive_notifications IS true",
+)
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, UniqueConstraint, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, UniqueConstraint, Boolean, Float, DateTime, Index, SmallInteger, CheckConstraint, func
 from sqlalchemy.orm import relationship
 from bot.database.db import Base
 
+
 class User(Base):
     __tablename__ = "users"
 
@@ -14,21 +15,94 @@ class User(Base):
         "Favorite",
         back_populates="user",
         cascade="all, delete-orphan",
-        lazy="select"
+        lazy="select",
+        order_by="Favorite.id"
     )
 
+    __table_args__ = (
+        # Частичный индекс для постраничного обхода подписчиков рассылки
+        Index("ix_users_notifications_id", id, postgresql_where=receive_notifications.is_(True)),
+    )
+
+# Локальный каталог фильмов, наполняемый из ответов TMDB
+class Movie(Base):
+    __tablename__ = "movies"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # id фильма в TMDB
+    title = Column(String, nullable=False)
+    original_title = Column(String, nullable=True)
+    overview = Column(String, nullable=True)
+    poster_path = Column(String, nullable=True)
+    release_date = Column(String, nullable=True)
+    popularity = Column(Float, nullable=True)
+    vote_average = Column(Float, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def to_dict(self) -> dict:
+        """Фильм в том же виде, что и элемент results ответа TMDB."""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "original_title": self.original_title,
+            "overview": self.overview,
+            "poster_path": self.poster_path,
+            "release_date": self.release_date,
+            "popularity": self.popularity,
+            "vote_average": self.vote_average,
+        }
+
+# file_id постеров, уже загруженных в Telegram, чтобы не скачивать их повторно
+class PosterFile(Base):
+    __tablename__ = "poster_files"
+
+    poster_path = Column(String, primary_key=True)
+    file_id = Column(String, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
 class Favorite(Base):
     __tablename__ = "favorites"
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    movie_id = Column(Integer, nullable=False)
-    movie_title = Column(String, nullable=False)
-    movie_overview = Column(String, nullable=True)
-    poster_url = Column(String, nullable=True)
+    movie_id = Column(Integer, ForeignKey("movies.id"), nullable=False)
+    # Номер ячейки 0..MAX_FAVORITES-1: уникальность (user_id, slot) держит лимит даже при параллельных вставках
+    slot = Column(SmallInteger, nullable=False)
 
     user = relationship("User", back_populates="favorites")
+    movie = relationship("Movie", lazy="joined")
 
     __table_args__ = (
         UniqueConstraint("user_id", "movie_id", name="uq_user_movie"),
-    )
\ No newline at end of file
+        UniqueConstraint("user_id", "slot", name="uq_user_slot"),
+        CheckConstraint("slot >= 0", name="ck_favorite_slot"),
+    )
+
+# Запуск рассылки: текст фиксируется, чтобы после перезапуска досылать то же сообщение
+class NotificationRun(Base):
+    __tablename__ = "notification_runs"
+
+    id = Column(Integer, primary_key=True)
+    run_key = Column(String, unique=True, nullable=False)
+    text = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    materialized_at = Column(DateTime(timezone=True), nullable=True)  # outbox заполнен полностью
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+# Outbox рассылки: одна строка на пару (запуск, пользователь)
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    run_id = Column(Integer, ForeignKey("notification_runs.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending, claimed, sent, blocked, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("run_id", "user_id", name="uq_outbox_run_user"),
+        # Частичный индекс: воркеры ищут только недоставленные строки
+        Index("ix_outbox_run_undelivered", "run_id", "id", postgresql_where=status.in_(("pending", "claimed"))),
+    )
@@ -1,17 +1,23 @@
 from aiogram import Router, types, Bot, F
 from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
-from bot.api_tmdb import GENRES, fetch_movies_by_genre, fetch_top_movies, fetch_recommendations, fetch_new_movies, search_movies_by_keyword, send_movie_preview
-from bot.database.db import async_session
-from bot.database.models import User
-from sqlalchemy import select
-from aiohttp import ClientSession
+from aiogram.types import InlineKeyboardMarkup, Message, CallbackQuery, InlineQuery
+from bot.api_tmdb import GENRES, tmdb
+from bot.catalog import get_movie_details
+from bot.views import (
+    send_movie_list, movie_card, ACTION_DELETE, GENRE_KEYBOARD, BACK_KEYBOARD, MORE_MOVIES_KEYBOARDS, NOTIFICATION_KEYBOARDS,
+    TOP_BUTTON, RECOMMENDATIONS_BUTTON, NEW_BUTTON, FAVORITES_BUTTON, BACK_TO_GENRES_BUTTON, search_more_keyboard,
+)
+from bot.storage import state_store
+from bot.pagination import get_window
+from bot.prefetch import prefetcher
+from bot.search_index import title_index
+from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from time import time
-from bot.config import TMDB_API_KEY
-from bot.database.crud import get_or_create_user_with_favorites, add_favorite, get_favorites, remove_favorite, get_user_by_id
-import aiohttp
+from bot.database.crud import (
+    resolve_user_id, add_favorite, get_favorite_movies, remove_favorite, get_user_by_id, FavoriteResult, MAX_FAVORITES,
+)
+import html
 import logging
 
 # Конфигурация логирования
@@ -22,80 +28,65 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-user_cooldowns = {}
 router = Router()
-user_data = {}
 
-class SearchState(StatesGroup):
-    waiting_for_query = State()
+# Состояние просмотра (жанр и страница) хранится в общем хранилище состояния
+async def get_user_data(chat_id: int) -> dict:
+    return await state_store.get(f"user_data:{chat_id}") or {"genre": None, "page": 1}
 
-def genre_keyboard():
-    buttons = [KeyboardButton(text=genre) for genre in GENRES]
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)])
-    keyboard.keyboard.append([KeyboardButton(text="🔥 Топ-3"), KeyboardButton(text="🎯 Рекомендации"), KeyboardButton(text="🆕 Новинки")])
-    keyboard.keyboard.append([KeyboardButton(text="⭐ Избранное")])
-    return keyboard
+async def set_user_data(chat_id: int, data: dict):
+    await state_store.set(f"user_data:{chat_id}", data)
 
-def back_keyboard():
-    return ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[[KeyboardButton(text="🔙 Назад к выбору жанра")]])
+FAVORITE_RESULT_TEXT = {
+    FavoriteResult.ADDED: "✅ Фильм добавлен в избранное ⭐",
+    FavoriteResult.DUPLICATE: "⚠️ Этот фильм уже в вашем списке избранного.",
+    FavoriteResult.LIMIT_REACHED: f"❗ Вы достигли лимита в {MAX_FAVORITES} избранных фильмов.",
+    FavoriteResult.ERROR: "⚠️ Не удалось добавить фильм. Повторите попытку.",
+}
 
-@router.callback_query(F.data.startswith("more_"))
-async def show_more_movies(callback: CallbackQuery, bot: Bot):
-    user_id = callback.from_user.id
-    now = time()
-    cooldown_seconds = 4
+# Фильмов на одной странице бота; страницы нарезаются из закэшированных страниц TMDB по 20
+GENRE_PAGE_SIZE = 3
+SEARCH_PAGE_SIZE = 5
+INLINE_RESULTS = 20      # результатов в ответе на inline-запрос
+INLINE_CACHE_TIME = 300  # сколько секунд Telegram кэширует ответ на inline-запрос
 
-    last_time = user_cooldowns.get(user_id, 0)
-    if now - last_time < cooldown_seconds:
-        await callback.answer("Подождите немного перед следующим запросом.", show_alert=False)
-        return
+def genre_loader(genre_name: str):
+    return lambda tmdb_page: tmdb.movies_by_genre(genre_name, tmdb_page)
+
+def search_loader(query: str):
+    return lambda tmdb_page: tmdb.search(query, page=tmdb_page)
+
+# Ответ, когда TMDB не ответил и в кэше нет даже устаревших данных
+TMDB_UNAVAILABLE_TEXT = "⚠️ Сервис с фильмами временно недоступен. Попробуйте чуть позже."
 
-    user_cooldowns[user_id] = now
+class SearchState(StatesGroup):
+    waiting_for_query = State()
 
+@router.callback_query(F.data.startswith("more_"))
+async def show_more_movies(callback: CallbackQuery, bot: Bot):
+    # Частоту нажатий ограничивает ThrottlingMiddleware
     genre_name = callback.data.split("_", 1)[1]
-    user_data[user_id]["page"] += 1  # Увеличиваем страницу
-    page = user_data[user_id]["page"]
+    chat_id = callback.message.chat.id
+    user_data = await get_user_data(chat_id)
+    user_data["page"] += 1  # Увеличиваем страницу
+    page = user_data["page"]
+    await set_user_data(chat_id, user_data)
 
     await send_movies(bot, callback.message.chat.id, genre_name, page)
     await callback.answer()
 
-def more_movies_keyboard(genre):
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Посмотреть ещё 🎥", callback_data=f"more_{genre}")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back")]
-    ])
-
-def notification_keyboard(enabled: bool) -> InlineKeyboardMarkup:
-    text = "🔕 Отключить уведомления" if enabled else "🔔 Включить уведомления"
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=text, callback_data="toggle_notifications")]
-        ]
-    )
-
 # Обработка команды /start — приветствие пользователя и показ клавиатуры с жанрами
 @router.message(Command("start"))
-async def start(message: types.Message):
-    user_data[message.chat.id] = {"genre": None, "page": 1}
-
-    async with async_session() as session:
-        result = await session.execute(
-            select(User).filter_by(telegram_id=message.from_user.id)
-        )
-        db_user = result.scalar_one_or_none()
-
-        if not db_user:
-            new_user = User(
-                telegram_id=message.from_user.id,
-                username=message.from_user.username
-            )
-            session.add(new_user)
-            await session.commit()
+async def start(message: types.Message, session: AsyncSession):
+    prefetcher.cancel(message.chat.id)
+    await set_user_data(message.chat.id, {"genre": None, "page": 1})
+    await resolve_user_id(session, message.from_user.id, message.from_user.username)
 
-    await message.answer("Привет! Выбери жанр фильма 👇", reply_markup=genre_keyboard())
+    await message.answer("Привет! Выбери жанр фильма 👇", reply_markup=GENRE_KEYBOARD)
 
 @router.message(Command("search"))
 async def search_command(message: Message, state: FSMContext):
+    prefetcher.cancel(message.chat.id)
     await message.answer("🔎 Введите название фильма для поиска:")
     await state.set_state(SearchState.waiting_for_query)
 
@@ -110,25 +101,33 @@ async def handle_search_query(message: Message, state: FSMContext):
 
     await state.update_data(query=query)  # сохраняем поисковый запрос в FSM
 
-    async with ClientSession() as session:
-        data = await search_movies_by_keyword(session, query, page=1)
+    # Сначала — локальный индекс уже известных боту фильмов, без запроса к TMDB
+    local = title_index.search(query, SEARCH_PAGE_SIZE)
+    if local:
+        await send_movie_list(
+            message.bot, message.chat.id, local,
+            "Нашлось среди известных боту фильмов. Не то? Посмотри результаты TMDB 👇", search_more_keyboard(1)
+        )
+        return  # TMDB запрашивается, только если пользователь нажмёт кнопку
 
-    if "error" in data:
+    load = search_loader(query)
+    window = await get_window(load, 1, SEARCH_PAGE_SIZE)
+
+    if window.error:
         await message.answer("Произошла ошибка при поиске. Попробуйте позже.")
         return
 
-    results = data.get("results", [])
-    if not results:
-        await message.answer(f"По запросу «{query}» ничего не найдено.")
+    if not window.movies:
+        await message.answer(f"По запросу «{html.escape(query)}» ничего не найдено.")
         return
 
-    for movie in results[:5]:
-        await send_movie_preview(message.bot, message.chat.id, movie)
-
-    more_keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="🔎 Посмотреть ещё", callback_data="search_more|2")
-    ]])
-    await message.answer("Хочешь посмотреть ещё результаты?", reply_markup=more_keyboard)
+    if window.has_more:
+        await send_movie_list(
+            message.bot, message.chat.id, window.movies, "Хочешь посмотреть ещё результаты?", search_more_keyboard(2)
+        )
+        prefetcher.schedule(message.chat.id, load, 2, SEARCH_PAGE_SIZE)
+    else:
+        await send_movie_list(message.bot, message.chat.id, window.movies, "Это все результаты поиска.")
 
 @router.callback_query(F.data.startswith("search_more|"))
 async def handle_search_more_callback(callback: CallbackQuery, state: FSMContext):
@@ -148,407 +147,264 @@ async def handle_search_more_callback(callback: CallbackQuery, state: FSMContext
         return
 
     try:
-        async with ClientSession() as session:
-            data = await search_movies_by_keyword(session, query, page=page)
+        load = search_loader(query)
+        window = await get_window(load, page, SEARCH_PAGE_SIZE)
     except Exception as e:
         logger.error(f"Ошибка при запросе фильмов: {e}")
         await callback.message.answer("Ошибка при получении фильмов. Попробуйте позже.")
         return
 
-    results = data.get("results", [])
-    if not results:
+    if window.error:
+        await callback.message.answer("Ошибка при получении фильмов. Попробуйте позже.")
+    elif not window.movies:
         await callback.message.answer("Больше фильмов не найдено.")
-        return
+    elif window.has_more:
+        await send_movie_list(
+            callback.bot, callback.message.chat.id, window.movies, "Ещё результаты:", search_more_keyboard(page + 1)
+        )
+        prefetcher.schedule(callback.message.chat.id, load, page + 1, SEARCH_PAGE_SIZE)
+    else:
+        await send_movie_list(callback.bot, callback.message.chat.id, window.movies, "Это все результаты поиска.")
+    await callback.answer()
 
-    for movie in results[:5]:
-        await send_movie_preview(callback.bot, callback.message.chat.id, movie)
 
-    next_page = page + 1
-    more_keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="🔎 Посмотреть ещё", callback_data=f"search_more|{next_page}")
-    ]])
-    await callback.message.answer("Ещё результаты:", reply_markup=more_keyboard)
+# Inline-режим: @бот <название> — подсказки из локального индекса, при промахе — из TMDB
+@router.inline_query()
+async def handle_inline_query(inline_query: InlineQuery):
+    query = inline_query.query.strip()
+    if len(query) < 2:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
 
+    movies = title_index.search(query, INLINE_RESULTS)
+    if not movies:
+        data = await tmdb.search(query)  # ответ TMDB пополнит индекс через хук результатов
+        movies = [movie for movie in data.get("results", []) if movie.get("id")][:INLINE_RESULTS]
+
+    await inline_query.answer([movie_card(movie).article() for movie in movies], cache_time=INLINE_CACHE_TIME)
 
 # Обработка нажатия кнопки "Назад к выбору жанра" — возврат к жанрам
-@router.message(lambda msg: msg.text == "🔙 Назад к выбору жанра")
+@router.message(lambda msg: msg.text == BACK_TO_GENRES_BUTTON)
 async def go_back(message: types.Message):
-    user_data[message.chat.id] = {"genre": None, "page": 1}
-    await message.answer("Выбери жанр снова 👇", reply_markup=genre_keyboard())
+    prefetcher.cancel(message.chat.id)
+    await set_user_data(message.chat.id, {"genre": None, "page": 1})
+    await message.answer("Выбери жанр снова 👇", reply_markup=GENRE_KEYBOARD)
 
 # Обработка выбора жанра или кнопок "Топ-3", "Рекомендации", "Новинки", "Избранное"
 @router.message(lambda message: not (message.text and message.text.startswith('/')))
-async def handle_genre_selection(message: types.Message, bot: Bot):
+async def handle_genre_selection(message: types.Message, bot: Bot, session: AsyncSession):
     genre_name = message.text
+    prefetcher.cancel(message.chat.id)  # пользователь ушёл с прежнего списка
     if genre_name in GENRES:
-        user_data[message.chat.id] = {"genre": genre_name, "page": 1}
+        await set_user_data(message.chat.id, {"genre": genre_name, "page": 1})
         await send_movies(bot, message.chat.id, genre_name, 1)
-    elif genre_name == "🔥 Топ-3":
+    elif genre_name == TOP_BUTTON:
         await send_top_movies(bot, message.chat.id)
-    elif genre_name == "🎯 Рекомендации":
+    elif genre_name == RECOMMENDATIONS_BUTTON:
         await send_recommendations(bot, message.chat.id)
-    elif genre_name == "🆕 Новинки":
+    elif genre_name == NEW_BUTTON:
         await send_new_movies(bot, message.chat.id)
-    elif genre_name == "⭐ Избранное":
-        await show_favorites(message)
+    elif genre_name == FAVORITES_BUTTON:
+        await show_favorites(message, session)
     else:
-        await message.answer("Выбери жанр из списка кнопок ⬇", reply_markup=genre_keyboard())
+        await message.answer("Выбери жанр из списка кнопок ⬇", reply_markup=GENRE_KEYBOARD)
 
 # Обработка callback-запроса "Назад" — возврат к выбору жанра
 @router.callback_query(lambda call: call.data == "back")
 async def back_to_genres(call: types.CallbackQuery):
-    user_data[call.message.chat.id] = {"genre": None, "page": 1}
-    await call.message.answer("Выбери жанр снова 👇", reply_markup=genre_keyboard())
-    await call.answer()
-
-# Обработка callback-запроса "Посмотреть ещё" — загрузка следующей страницы фильмов
-@router.callback_query(lambda call: call.data.startswith("more_"))
-async def more_movies(call: types.CallbackQuery, bot: Bot):
-    genre_name = call.data.split("_", 1)[1]
-    user_data[call.message.chat.id]["page"] += 1
-    page = user_data[call.message.chat.id]["page"]
-    await send_movies(bot, call.message.chat.id, genre_name, page)
-    await call.message.edit_reply_markup(reply_markup=None) # Удаляем старую клавиатуру, чтобы не было старых кнопок
+    prefetcher.cancel(call.message.chat.id)
+    await set_user_data(call.message.chat.id, {"genre": None, "page": 1})
+    await call.message.answer("Выбери жанр снова 👇", reply_markup=GENRE_KEYBOARD)
     await call.answer()
 
-async def get_movie_details(movie_id: int):
-    url = f'https://api.themoviedb.org/3/movie/{movie_id}'
-    params = {
-        'api_key': TMDB_API_KEY,
-        'language': 'ru'
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as response:
-            data = await response.json()
-            return data
-
 @router.callback_query(lambda call: call.data.startswith("remove_fav_"))
-async def remove_from_favorites(call: types.CallbackQuery, bot: Bot):
+async def remove_from_favorites(call: types.CallbackQuery, bot: Bot, session: AsyncSession):
     movie_id = int(call.data.split("_")[2])
     chat_id = call.message.chat.id
 
-    async with async_session() as session:
-        user = await get_or_create_user_with_favorites(session, chat_id, "")
-        favorites = await get_favorites(session, user)
+    user_id = await resolve_user_id(session, chat_id, call.from_user.username)
+    title = await remove_favorite(session, user_id, movie_id)
 
-        # Находим фильм в избранном
-        favorite_movie = next((f for f in favorites if f.movie_id == movie_id), None)
-
-        if favorite_movie:
-            # Удаляем фильм из избранного
-            session.delete(favorite_movie)
-            await session.commit()
-            await call.message.answer(f"✅ Фильм '{favorite_movie.movie_title}' удален из избранного.")
-            # Отправляем обновленный список избранных
-            await send_favorites(bot, chat_id)
-        else:
-            await call.message.answer("⚠️ Этот фильм не найден в вашем списке избранных.")
+    if title:
+        await call.message.answer(f"✅ Фильм '{html.escape(title)}' удален из избранного.")
+        # Отправляем обновленный список избранных
+        await send_favorites(bot, chat_id, session)
+    else:
+        await call.message.answer("⚠️ Этот фильм не найден в вашем списке избранных.")
 
     await call.answer()
 
 @router.callback_query(lambda call: call.data.startswith("del_"))
-async def delete_from_favorites(call: types.CallbackQuery):
+async def delete_from_favorites(call: types.CallbackQuery, session: AsyncSession):
     movie_id = int(call.data.split("_")[1])
     chat_id = call.message.chat.id
 
-    async with async_session() as session:
-        user = await get_or_create_user_with_favorites(session, chat_id, call.from_user.username)
-        success = await remove_favorite(session, user, movie_id)
+    user_id = await resolve_user_id(session, chat_id, call.from_user.username)
+    success = await remove_favorite(session, user_id, movie_id)
 
     if success:
-        await call.message.delete()  # Удалить сообщение с фильмом
+        await remove_movie_button(call)
         await call.answer("🗑 Фильм удалён из избранного.")
     else:
         await call.answer("⚠️ Не удалось удалить фильм.")
 
-# Отправка фильмов по выбранному жанру
+# Убирает кнопку удалённого фильма; сообщение с одним фильмом удаляется целиком
+async def remove_movie_button(call: types.CallbackQuery):
+    markup = call.message.reply_markup
+    rows = [
+        row for row in (markup.inline_keyboard if markup else [])
+        if not any(button.callback_data == call.data for button in row)
+    ]
+    if any(button.callback_data and button.callback_data.startswith("del_") for row in rows for button in row):
+        await call.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+    else:
+        await call.message.delete()  # Удалить сообщение с фильмом
+
+# Отправка фильмов по выбранному жанру; page — страница бота по GENRE_PAGE_SIZE фильмов
 async def send_movies(bot, chat_id, genre_name, page):
-    async with ClientSession() as session:
-        data = await fetch_movies_by_genre(session, genre_name, page)
+    load = genre_loader(genre_name)
+    window = await get_window(load, page, GENRE_PAGE_SIZE)
 
-    results = data.get("results")
-    if not results:
+    if window.error:
+        await bot.send_message(chat_id, TMDB_UNAVAILABLE_TEXT)
+        return
+    if not window.movies:
         await bot.send_message(chat_id, "Фильмы не найдены 😔")
         return
 
-    last_movie_id = None
-    for movie in results[:3]:
-        title = movie.get("title", "Без названия")
-        release = movie.get("release_date", "неизвестно")[:4]
-        desc = movie.get("overview", "Описание отсутствует.")
-        text = f"🎬 *{title} ({release})*\n\n{desc}"
-
-        poster_path = movie.get("poster_path")
-        poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
-        poster_data = poster_path or "no_image"
-
-        inline_button = InlineKeyboardButton(
-            text="⭐ В избранное",
-            callback_data=f"fav_{movie['id']}_{poster_data}"
-        )
-        inline_keyboard = InlineKeyboardMarkup(inline_keyboard=[[inline_button]])
-
-        if poster_url:
-            await bot.send_photo(chat_id, poster_url, caption=text, parse_mode="Markdown", reply_markup=inline_keyboard)
-        else:
-            await bot.send_message(chat_id, text, parse_mode="Markdown", reply_markup=inline_keyboard)
-
-        last_movie_id = movie["id"]
-
-    if last_movie_id:
-        await bot.send_message(
-            chat_id,
+    if window.has_more:
+        await send_movie_list(
+            bot, chat_id, window.movies,
             "Не понравилось? Посмотри ещё фильмы 👇",
-            reply_markup=more_movies_keyboard(genre_name)
+            MORE_MOVIES_KEYBOARDS[genre_name]
         )
+        # Следующую страницу, скорее всего, попросят через несколько секунд
+        prefetcher.schedule(chat_id, load, page + 1, GENRE_PAGE_SIZE)
+    else:
+        await send_movie_list(bot, chat_id, window.movies, "Это все фильмы жанра 🎬", BACK_KEYBOARD)
 
 # Отправка новых фильмов
 async def send_new_movies(bot: Bot, chat_id: int):
-    async with ClientSession() as session:
-        data = await fetch_new_movies(session)
-        results = data.get("results")
-        if not results:
-            await bot.send_message(chat_id, "Новинки не найдены 😔", reply_markup=genre_keyboard())
-            return
-
-        for movie in data["results"][:5]:  # Показываем, первые 5 новинок
-            title = movie.get("title", "Без названия")
-            release = movie.get("release_date", "неизвестно")[:4]
-            overview = movie.get("overview", "Описание отсутствует.")
-            poster_path = movie.get("poster_path")
-            poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
-
-            caption = f"🎬 *{title} ({release})*\n\n{overview}"
-
-            inline_button = InlineKeyboardButton(
-                text="⭐ В избранное",
-                callback_data=f"fav_{movie['id']}_{poster_path or 'no_image'}"
-            )
-            inline_keyboard = InlineKeyboardMarkup(inline_keyboard=[[inline_button]])
-
-            if poster_url:
-                await bot.send_photo(
-                    chat_id, poster_url, caption=caption,
-                    parse_mode="Markdown", reply_markup=inline_keyboard
-                )
-            else:
-                await bot.send_message(
-                    chat_id, caption, parse_mode="Markdown",
-                    reply_markup=inline_keyboard
-                )
-
-        await bot.send_message(chat_id, "Это новинки кино! 🆕", reply_markup=genre_keyboard())
+    data = await tmdb.new_movies()
+    if "error" in data:
+        await bot.send_message(chat_id, TMDB_UNAVAILABLE_TEXT, reply_markup=GENRE_KEYBOARD)
+        return
+    results = data.get("results")
+    if not results:
+        await bot.send_message(chat_id, "Новинки не найдены 😔", reply_markup=GENRE_KEYBOARD)
+        return
+
+    # Показываем первые 5 новинок
+    await send_movie_list(bot, chat_id, results[:5], "Это новинки кино! 🆕", GENRE_KEYBOARD)
 
 # Отправка топ-3 фильмов
 async def send_top_movies(bot, chat_id):
-    async with ClientSession() as session:
-        data = await fetch_top_movies(session)
-        results = data.get("results")
-        if not results:
-            await bot.send_message(chat_id, "Фильмы не найдены 😔")
-            return
-
-        for movie in data["results"][:3]:
-            title = movie.get("title", "Без названия")
-            release = movie.get("release_date", "неизвестно")[:4]
-            desc = movie.get("overview", "Описание отсутствует.")
-            text = f"🎬 *{title} ({release})*\n\n{desc}"
-
-            # Постер и кнопка
-            poster_path = movie.get("poster_path", "")
-            poster = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
-            inline_button = InlineKeyboardButton(
-                text="⭐ В избранное",
-                callback_data=f"fav_{movie['id']}_{poster_path or 'no_image'}"
-            )
-            inline_keyboard = InlineKeyboardMarkup(inline_keyboard=[[inline_button]])
-
-            if poster:
-                await bot.send_photo(chat_id, poster, caption=text, parse_mode="Markdown", reply_markup=inline_keyboard)
-            else:
-                await bot.send_message(chat_id, text, parse_mode="Markdown", reply_markup=inline_keyboard)
-
-        await bot.send_message(chat_id, "Это топ-3 фильмов! 🔥", reply_markup=back_keyboard())
+    data = await tmdb.top_movies()
+    if "error" in data:
+        await bot.send_message(chat_id, TMDB_UNAVAILABLE_TEXT)
+        return
+    results = data.get("results")
+    if not results:
+        await bot.send_message(chat_id, "Фильмы не найдены 😔")
+        return
+
+    await send_movie_list(bot, chat_id, results[:3], "Это топ-3 фильмов! 🔥", BACK_KEYBOARD)
 
 # Отправка рекомендованных фильмов
 async def send_recommendations(bot, chat_id):
-    async with ClientSession() as session:
-        data = await fetch_recommendations(session)
-        results = data.get("results")
-        if not results:
-            await bot.send_message(chat_id, "Фильмы не найдены 😔")
-            return
-
-        for movie in data["results"][:3]:
-            title = movie.get("title", "Без названия")
-            release = movie.get("release_date", "неизвестно")[:4]
-            desc = movie.get("overview", "Описание отсутствует.")
-            text = f"🎬 *{title} ({release})*\n\n{desc}"
-
-            poster_path = movie.get("poster_path", "")
-            poster = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
-            inline_button = InlineKeyboardButton(
-                text="⭐ В избранное",
-                callback_data=f"fav_{movie['id']}_{poster_path or 'no_image'}"
-            )
-            inline_keyboard = InlineKeyboardMarkup(inline_keyboard=[[inline_button]])
-
-            if poster:
-                await bot.send_photo(chat_id, poster, caption=text, parse_mode="Markdown", reply_markup=inline_keyboard)
-            else:
-                await bot.send_message(chat_id, text, parse_mode="Markdown", reply_markup=inline_keyboard)
-
-        await bot.send_message(chat_id, "Попробуй эти фильмы! 🎯", reply_markup=back_keyboard())
+    data = await tmdb.recommendations()
+    if "error" in data:
+        await bot.send_message(chat_id, TMDB_UNAVAILABLE_TEXT)
+        return
+    results = data.get("results")
+    if not results:
+        await bot.send_message(chat_id, "Фильмы не найдены 😔")
+        return
+
+    await send_movie_list(bot, chat_id, results[:3], "Попробуй эти фильмы! 🎯", BACK_KEYBOARD)
 
 @router.callback_query(lambda call: call.data == "more_recommendations")
 async def more_recommendations(call: types.CallbackQuery, bot: Bot):
-    user_data[call.message.chat.id]["recommendations_page"] = user_data[call.message.chat.id].get(
-        "recommendations_page", 1) + 1
+    user_data = await get_user_data(call.message.chat.id)
+    user_data["recommendations_page"] = user_data.get("recommendations_page", 1) + 1
+    await set_user_data(call.message.chat.id, user_data)
 
     await send_recommendations(bot, call.message.chat.id)
     await call.answer()
 
 # Отправка избранных фильмов — как обычных фильмов по жанру, с кнопкой удаления
-async def send_favorites(bot, chat_id):
-    async with async_session() as session:
-        user = await get_or_create_user_with_favorites(session, chat_id, "")
-        favorites = await get_favorites(session, user)
+async def send_favorites(bot, chat_id, session: AsyncSession):
+    user_id = await resolve_user_id(session, chat_id)
+    movies = await get_favorite_movies(session, user_id)
 
-    if not favorites:
+    if not movies:
         await bot.send_message(chat_id, "У вас нет избранных фильмов 😔")
         return
 
-    for favorite in favorites:
-        title = favorite.movie_title
-        desc = favorite.movie_overview or "Описание отсутствует."
-        poster = favorite.poster_url
-        text = f"🎬 *{title}*\n\n{desc}"
-
-        # Кнопка "Удалить из избранного"
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🗑 Удалить из избранного", callback_data=f"del_{favorite.movie_id}")]
-        ])
-
-        if poster:
-            await bot.send_photo(chat_id, photo=poster, caption=text, parse_mode="Markdown", reply_markup=keyboard)
-        else:
-            await bot.send_message(chat_id, text, parse_mode="Markdown", reply_markup=keyboard)
-
-    await bot.send_message(chat_id, "Это ваш список избранных фильмов! ⭐", reply_markup=back_keyboard())
+    await send_movie_list(
+        bot, chat_id, movies, "Это ваш список избранных фильмов! ⭐", BACK_KEYBOARD, action=ACTION_DELETE
+    )
 
 # Функция для отображения избранных фильмов
-async def show_favorites(message: types.Message):
-    async with async_session() as session:
-        user = await get_or_create_user_with_favorites(session, message.chat.id, message.from_user.username)
-        favorites = await get_favorites(session, user)
+async def show_favorites(message: types.Message, session: AsyncSession):
+    user_id = await resolve_user_id(session, message.chat.id, message.from_user.username)
+    movies = await get_favorite_movies(session, user_id)
 
-    if not favorites:
-        await message.answer("У вас нет избранных фильмов 😔", reply_markup=back_keyboard())
+    if not movies:
+        await message.answer("У вас нет избранных фильмов 😔", reply_markup=BACK_KEYBOARD)
         return
 
-    for favorite in favorites:
-        title = favorite.movie_title
-        desc = favorite.movie_overview or "Описание отсутствует."
-        poster = favorite.poster_url
-        text = f"*{title}*\n\n{desc}"
-        logger.info(f"[show_favorites] Poster URL для фильма {title}: {poster}")
-
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="🗑 Удалить из избранного", callback_data=f"del_{favorite.movie_id}")
-        ]])
-
-        try:
-            if poster:
-                await message.bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=poster,
-                    caption=text,
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
-            else:
-                await message.bot.send_message(
-                    chat_id=message.chat.id,
-                    text=text,
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке фильма {title}: {str(e)}")
-
-    await message.answer("Это ваш список избранных фильмов! ⭐", reply_markup=back_keyboard())
+    logger.info(f"[show_favorites] {len(movies)} избранных фильмов для чата {message.chat.id}")
+    await send_movie_list(
+        message.bot, message.chat.id, movies,
+        "Это ваш список избранных фильмов! ⭐", BACK_KEYBOARD, action=ACTION_DELETE
+    )
 
 @router.callback_query(lambda c: c.data.startswith("fav_"))
-async def add_to_favorites(call: types.CallbackQuery):
-    parts = call.data.split("_", 2)
-    movie_id = int(parts[1])
-    poster_path = parts[2] if len(parts) > 2 and parts[2] != 'no_image' else None
+async def add_to_favorites(call: types.CallbackQuery, session: AsyncSession):
+    # Формат: fav_<movie_id> (в старых сообщениях ещё и _<poster_path>)
+    movie_id = int(call.data.split("_")[1])
 
     chat_id = call.message.chat.id
     username = call.from_user.username
 
-    message = call.message
-    text = message.caption or message.text
-    title = text.split("\n")[0].replace("🎬 *", "").replace("*", "")
-    overview = "\n".join(text.split("\n")[1:]).strip()
-
-    poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
-    logger.info(f"[add_to_favorites] Poster URL для фильма {title}: {poster_url}")
-
-    async with async_session() as session:
-        user = await get_or_create_user_with_favorites(session, chat_id, username)
-        movie_data = {
-            "id": movie_id,
-            "title": title,
-            "overview": overview,
-            "poster": poster_url
-        }
-
-        favorites = await get_favorites(session, user)
-
-        if any(f.movie_id == movie_id for f in favorites):
-            await call.message.answer("⚠️ Этот фильм уже в вашем списке избранного.")
-        elif len(favorites) >= 10:
-            await call.message.answer("❗ Вы достигли лимита в 10 избранных фильмов.")
-        else:
-            success = await add_favorite(session, user, movie_data)
-            if success:
-                await call.message.answer("✅ Фильм добавлен в избранное ⭐")
-            else:
-                await call.message.answer("⚠️ Не удалось добавить фильм. Повторите попытку.")
+    movie = await get_movie_details(movie_id, session)
+    if movie is None:
+        await call.message.answer("⚠️ Не удалось добавить фильм. Повторите попытку.")
+        await call.answer()
+        return
+    logger.info(f"[add_to_favorites] Фильм {movie.title} ({movie_id})")
+
+    user_id = await resolve_user_id(session, chat_id, username)
+    result = await add_favorite(session, user_id, movie_id)
+    await call.message.answer(FAVORITE_RESULT_TEXT[result])
     await call.answer()
 
 @router.message(Command("notifications"))
-async def show_notifications_setting(message: Message):
-    async with async_session() as session:
-        user = await get_user_by_id(session, message.from_user.id)
-        if not user:
-            await message.answer("Сначала начни диалог с ботом командой /start.")
-            return
+async def show_notifications_setting(message: Message, session: AsyncSession):
+    user = await get_user_by_id(session, message.from_user.id)
+    if not user:
+        await message.answer("Сначала начни диалог с ботом командой /start.")
+        return
 
-        status_text = "🔔 Уведомления включены." if user.receive_notifications else "🔕 Уведомления отключены."
-        kb = notification_keyboard(user.receive_notifications)
+    status_text = "🔔 Уведомления включены." if user.receive_notifications else "🔕 Уведомления отключены."
+    kb = NOTIFICATION_KEYBOARDS[user.receive_notifications]
 
-        await message.answer(f"{status_text}\nВы можете изменить настройки:", reply_markup=kb)
+    await message.answer(f"{status_text}\nВы можете изменить настройки:", reply_markup=kb)
 
 @router.callback_query(F.data == "toggle_notifications")
-async def handle_toggle_notifications_callback(callback: CallbackQuery):
-    async with async_session() as session:
-        result = await session.execute(
-            select(User).filter_by(telegram_id=callback.from_user.id)
-        )
-        user = result.scalar_one_or_none()
+async def handle_toggle_notifications_callback(callback: CallbackQuery, session: AsyncSession):
+    user = await get_user_by_id(session, callback.from_user.id)
 
-        if not user:
-            await callback.answer("Сначала начни с команды /start.")
-            return
+    if not user:
+        await callback.answer("Сначала начни с команды /start.")
+        return
 
-        user.receive_notifications = not user.receive_notifications
-        await session.commit()
+    # Изменение сохранит DbSessionMiddleware при завершении обработки
+    user.receive_notifications = not user.receive_notifications
 
-        text = "🔔 Уведомления включены." if user.receive_notifications else "🔕 Уведомления отключены."
-        new_kb = notification_keyboard(user.receive_notifications)
+    text = "🔔 Уведомления включены." if user.receive_notifications else "🔕 Уведомления отключены."
+    new_kb = NOTIFICATION_KEYBOARDS[user.receive_notifications]
 
-        await callback.message.edit_reply_markup(reply_markup=new_kb)
-        await callback.answer(text)
\ No newline at end of file
+    await callback.message.edit_reply_markup(reply_markup=new_kb)
+    await callback.answer(text)
\ No newline at end of file
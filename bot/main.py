@@ -2,11 +2,28 @@ import logging
 import asyncio
 from aiogram import Bot, Dispatcher
 from bot.commands import set_commands
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.bot import DefaultBotProperties
-from bot.config import TELEGRAM_API_TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from bot.config import (
+    TELEGRAM_API_TOKEN, TELEGRAM_API_URL, THROTTLE_SHARED, THROTTLE_ENABLED, BOT_MODE, SHARD_WORKERS, METRICS_PORT,
+    TRACE_ENABLED, TRACE_SAMPLE_RATE,
+)
 from bot.handlers import router
+from bot import admin
+from bot.api_tmdb import tmdb
+from bot.storage import StateStoreStorage, state_store
+from bot.middlewares.throttling import ThrottlingMiddleware
+from bot.middlewares.database import DbSessionMiddleware
+from bot.metrics import HandlerMetricsMiddleware, BotApiMetricsMiddleware
+from bot import metrics
+from bot.tracing import TracingMiddleware, BotApiTracingMiddleware, exporter
+from typing import Optional
+from aiohttp import web
 from bot.database import init_db
+from bot.search_index import title_index, load_catalog
+from bot.notifications import scheduler
+from bot.webhook import run_webhook
 
 # Конфигурация логирования
 logging.basicConfig(
@@ -21,39 +38,81 @@ bot_properties = DefaultBotProperties(parse_mode="HTML")
 
 # Создание бота и диспетчера
 def create_bot_and_dispatcher() -> tuple[Bot, Dispatcher]:
-    bot = Bot(token=TELEGRAM_API_TOKEN, default=bot_properties)
-    dp = Dispatcher(storage=MemoryStorage())
+    # TELEGRAM_API_URL — свой Bot API сервер (локальный telegram-bot-api или заглушка стенда)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=TELEGRAM_API_TOKEN, session=session, default=bot_properties)
+    bot.session.middleware(BotApiMetricsMiddleware())
+    dp = Dispatcher(storage=StateStoreStorage(state_store))
+    # Корневой участок — на всё обновление, включая throttling и middleware сессии БД.
+    # Медленные обновления записываются всегда; обычные — только выборочно при TRACE_ENABLED
+    dp.update.outer_middleware(TracingMiddleware(sample_rate=TRACE_SAMPLE_RATE if TRACE_ENABLED else 0.0))
+    bot.session.middleware(BotApiTracingMiddleware())
+    if THROTTLE_ENABLED:
+        throttling = ThrottlingMiddleware(store=state_store if THROTTLE_SHARED else None)
+        router.message.outer_middleware(throttling)
+        router.callback_query.outer_middleware(throttling)
+        router.inline_query.outer_middleware(throttling)
+    # Время обработчика считается вместе с commit сессии БД
+    router.message.middleware(HandlerMetricsMiddleware())
+    router.callback_query.middleware(HandlerMetricsMiddleware())
+    router.inline_query.middleware(HandlerMetricsMiddleware())
+    # Сессия открывается только для обновлений, дошедших до обработчика
+    router.message.middleware(DbSessionMiddleware())
+    router.callback_query.middleware(DbSessionMiddleware())
+    dp.include_router(admin.router)
     dp.include_router(router)
     return bot, dp
 
 # Основная точка входа
 async def main():
     bot, dp = create_bot_and_dispatcher()
+    metrics_runner: Optional[web.AppRunner] = None
     try:
         logger.info("🔧 Инициализация базы данных...")
         await init_db()
+        await load_catalog(title_index)
+
+        logger.info("🌐 Подключение к TMDB...")
+        await tmdb.start()
 
-        logger.info("🚀 Запуск бота...")
-        await bot.delete_webhook(drop_pending_updates=True)
+        logger.info("🚀 Запуск бота (режим %s)...", BOT_MODE)
         await set_commands(bot)
+        scheduler.start(bot)
 
         print("✅ Бот успешно запущен и готов к работе.")
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # Накопившиеся за время деплоя обновления не сбрасываем
+            await bot.delete_webhook(drop_pending_updates=False)
+            if METRICS_PORT:
+                metrics_runner = await metrics.serve()
+            await dp.start_polling(bot)
 
     except Exception as e:
         logger.exception("❌ Не удалось запустить бота: %s", e)
 
     finally:
         logger.info("🔒 Завершение сессии бота.")
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if scheduler.scheduler.running:
+            scheduler.scheduler.shutdown(wait=False)
         await dp.storage.close()
         if hasattr(dp.storage, "wait_closed"):
             await dp.storage.wait_closed()
+        await tmdb.close()
         await bot.session.close()
+        exporter.close()
         logger.info("✅ Бот успешно завершил работу.")
 
 # Точка запуска
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if SHARD_WORKERS > 1:
+            from bot.sharding import run_sharded
+            asyncio.run(run_sharded())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("🛑 Остановка по запросу пользователя.")
@@ -0,0 +1,166 @@
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, JobEvent
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client import multiprocess
+from bot.config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм: от миллисекунд (кэш, БД) до секунд (TMDB с повторами)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HANDLER_SECONDS = Histogram(
+    "filmbot_handler_seconds", "Время обработки обновления обработчиком", ["handler"], buckets=LATENCY_BUCKETS,
+)
+HANDLER_ERRORS = Counter("filmbot_handler_errors_total", "Исключения в обработчиках", ["handler", "error"])
+
+TMDB_REQUEST_SECONDS = Histogram(
+    "filmbot_tmdb_request_seconds", "Запросы к TMDB (каждая попытка)", ["endpoint", "status"], buckets=LATENCY_BUCKETS,
+)
+TMDB_CACHE_LOOKUPS = Counter("filmbot_tmdb_cache_lookups_total", "Обращения к кэшу ответов TMDB", ["endpoint", "result"])
+
+DB_QUERY_SECONDS = Histogram(
+    "filmbot_db_query_seconds", "Время выполнения SQL-запросов", ["statement"], buckets=LATENCY_BUCKETS,
+)
+
+BOT_API_SECONDS = Histogram(
+    "filmbot_bot_api_seconds", "Запросы к Telegram Bot API", ["method"], buckets=LATENCY_BUCKETS,
+)
+BOT_API_ERRORS = Counter("filmbot_bot_api_errors_total", "Ошибки Telegram Bot API", ["method", "error"])
+BOT_API_RETRY_AFTER = Counter("filmbot_bot_api_retry_after_total", "Ответы Bot API с RetryAfter (flood control)", ["method"])
+
+UPDATE_QUEUE_DEPTH = Gauge("filmbot_update_queue_depth", "Обновлений в очереди на обработку", ["queue"])
+SHARD_UPDATES_REQUEUED = Counter(
+    "filmbot_shard_updates_requeued_total", "Обновления, заново переданные перезапущенному процессу", ["shard"],
+)
+SHARD_UPDATES_LOST = Counter("filmbot_shard_updates_lost_total", "Обновления, потерянные при падении процесса", ["shard"])
+SCHEDULER_JOB_SECONDS = Gauge(
+    "filmbot_scheduler_job_last_duration_seconds", "Длительность последнего запуска задачи планировщика", ["job"],
+)
+SCHEDULER_JOB_ERRORS = Counter("filmbot_scheduler_job_errors_total", "Ошибки задач планировщика", ["job"])
+
+_ID_SEGMENT = re.compile(r"/\d+")
+# Обновление значений, которые дешевле снять в момент сбора (глубина очередей и т.п.)
+_scrape_hooks: list[Callable[[], None]] = []
+
+
+def on_scrape(hook: Callable[[], None]) -> None:
+    _scrape_hooks.append(hook)
+
+
+def endpoint_label(path: str) -> str:
+    """Путь без числовых идентификаторов, чтобы не плодить метки: /movie/123 → /movie/{id}."""
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+def statement_label(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+    return word if word in ("select", "insert", "update", "delete", "with") else "other"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: время и ошибки по имени обработчика."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Bot API и ответы RetryAfter."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            BOT_API_RETRY_AFTER.labels(name).inc()
+            raise
+        except TelegramAPIError as e:
+            BOT_API_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            BOT_API_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def watch_scheduler(scheduler) -> None:
+    """Длительность и ошибки задач APScheduler по событиям планировщика."""
+    started: dict[str, float] = {}
+
+    def listener(event: JobEvent) -> None:
+        if event.code == EVENT_JOB_SUBMITTED:
+            started[event.job_id] = time.monotonic()
+            return
+        begin = started.pop(event.job_id, None)
+        if begin is not None:
+            SCHEDULER_JOB_SECONDS.labels(event.job_id).set(time.monotonic() - begin)
+        if event.code == EVENT_JOB_ERROR:
+            SCHEDULER_JOB_ERRORS.labels(event.job_id).inc()
+
+    scheduler.add_listener(listener, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+
+def _registry() -> CollectorRegistry:
+    # В многопроцессном режиме метрики процессов собираются из PROMETHEUS_MULTIPROC_DIR
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    for hook in _scrape_hooks:
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"Ошибка при сборе метрик: {e}")
+    body = generate_latest(_registry())
+    return web.Response(body=body, headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+def add_routes(app: web.Application) -> None:
+    app.router.add_get("/metrics", handle_metrics)
+
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """Отдельный HTTP-сервер для /metrics (режим polling, где нет webhook-приложения)."""
+    app = web.Application()
+    add_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
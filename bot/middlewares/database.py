@@ -0,0 +1,37 @@
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.database.crud import publish_favorites_versions
+from bot.database.db import async_session
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Одна сессия БД на обновление: commit в конце обработки, rollback при ошибке.
+
+    После commit записывает новые версии изменённого избранного (publish_favorites_versions).
+
+    Сессия передаётся обработчику в параметре session; в session.info["users"]
+    хранятся уже загруженные за это обновление пользователи.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker[AsyncSession] = async_session):
+        self.session_pool = session_pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with self.session_pool() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            await session.commit()
+            # До ответа webhook и до следующего обновления: иначе другой процесс успеет прочитать старый список
+            await publish_favorites_versions(session)
+            return result
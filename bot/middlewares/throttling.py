@@ -0,0 +1,133 @@
+import time
+from typing import Any, Awaitable, Callable, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Message, CallbackQuery, InlineQuery
+from bot.cache import TTLCache
+from bot.config import THROTTLE_USER_RATE, THROTTLE_USER_BURST, STATE_MAX_ENTRIES
+from bot.handlers import SearchState
+from bot.storage import StateStore
+from bot.views import GENRE_KEYBOARD, BACK_TO_GENRES_BUTTON, FAVORITES_BUTTON
+
+# Лимиты по классам обработчиков: (токенов в секунду, размер корзины)
+DEFAULT_LIMITS = {
+    "more": (0.25, 1),        # «Посмотреть ещё» — не чаще раза в 4 секунды
+    "browse": (0.5, 3),       # жанры, топ, рекомендации, новинки
+    "search": (0.2, 2),       # запросы к /search/movie
+    "inline": (3.0, 10),      # inline-режим: Telegram шлёт запрос на каждое нажатие клавиши
+    "favorites": (1.0, 4),
+    "command": (0.5, 3),
+    "callback": (1.0, 4),
+}
+
+# Кнопки клавиатур берутся из views, чтобы не расходиться с тем, что видит пользователь
+BUTTON_CLASSES = {
+    **{button.text: "browse" for row in GENRE_KEYBOARD.keyboard for button in row},
+    BACK_TO_GENRES_BUTTON: "browse",
+    FAVORITES_BUTTON: "favorites",
+}
+WARN_INTERVAL = 10  # не чаще одного предупреждения о лимите за это время
+INLINE_REJECT_CACHE_TIME = 1  # пустой ответ на отброшенный inline-запрос не должен залипать в кэше Telegram
+
+
+def classify(event: TelegramObject, raw_state: Optional[str] = None) -> str:
+    """Класс обработчика, к которому относится обновление."""
+    if isinstance(event, InlineQuery):
+        return "inline"
+    if isinstance(event, CallbackQuery):
+        data = event.data or ""
+        if data.startswith(("more_", "search_more|")):
+            return "more"
+        if data.startswith(("fav_", "del_", "remove_fav_")):
+            return "favorites"
+        return "callback"
+
+    text = getattr(event, "text", None) or ""
+    if text.startswith("/"):
+        return "command"
+    # В TMDB уходит только текст, введённый после /search; остальной текст — навигация
+    if raw_state == SearchState.waiting_for_query.state:
+        return "search"
+    return BUTTON_CLASSES.get(text, "browse")
+
+
+class TokenBuckets:
+    """Корзины токенов: O(1) на проверку, состояние — (токены, время обновления)."""
+
+    def __init__(self, store: Optional[StateStore] = None, maxsize: int = STATE_MAX_ENTRIES):
+        self.store = store
+        self._local = TTLCache(maxsize=maxsize, ttl=3600)
+
+    async def _load(self, key: str) -> Optional[tuple[float, float]]:
+        if self.store is None:
+            return self._local.get(key)
+        value = await self.store.get(key)
+        return tuple(value) if value else None
+
+    async def _save(self, key: str, tokens: float, updated: float, ttl: int) -> None:
+        if self.store is None:
+            self._local.set(key, (tokens, updated), ttl)
+        else:
+            await self.store.set(key, [tokens, updated], ttl)
+
+    async def consume(self, key: str, rate: float, burst: int) -> bool:
+        """Забирает токен; False — лимит исчерпан."""
+        now = time.time()
+        state = await self._load(key)
+        tokens = burst if state is None else min(burst, state[0] + (now - state[1]) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Запись живёт, пока корзина не наполнится снова
+        await self._save(key, tokens, now, int((burst - tokens) / rate) + 1)
+        return allowed
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Отбрасывает лишние обновления до обработчиков, не тратя запросы к TMDB и Bot API."""
+
+    def __init__(
+        self,
+        store: Optional[StateStore] = None,
+        limits: Optional[dict[str, tuple[float, int]]] = None,
+        user_rate: float = THROTTLE_USER_RATE,
+        user_burst: int = THROTTLE_USER_BURST,
+    ):
+        self.buckets = TokenBuckets(store)
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self._warned = TTLCache(maxsize=STATE_MAX_ENTRIES, ttl=WARN_INTERVAL)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+
+        handler_class = classify(event, data.get("raw_state"))
+        rate, burst = self.limits.get(handler_class, (self.user_rate, self.user_burst))
+        allowed = (
+            # Нажатия клавиш в inline-режиме не расходуют общий лимит пользователя
+            (handler_class == "inline" or await self.buckets.consume(f"throttle:{user.id}", self.user_rate, self.user_burst))
+            and await self.buckets.consume(f"throttle:{user.id}:{handler_class}", rate, burst)
+        )
+        if allowed:
+            return await handler(event, data)
+
+        await self._reject(event, user.id)
+        return None
+
+    async def _reject(self, event: TelegramObject, user_id: int) -> None:
+        if isinstance(event, CallbackQuery):
+            # Ответ на callback обязателен, иначе у кнопки висят «часики»
+            await event.answer("Подождите немного перед следующим запросом.", show_alert=False)
+        elif isinstance(event, InlineQuery):
+            # Без ответа клиент Telegram показывает бесконечную загрузку
+            await event.answer([], cache_time=INLINE_REJECT_CACHE_TIME, is_personal=True)
+        elif isinstance(event, Message) and user_id not in self._warned:
+            self._warned.set(user_id, True)
+            await event.answer("Слишком много запросов, подождите немного ⏳")
@@ -0,0 +1,114 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from sqlalchemy import select, update
+from bot.config import BROADCAST_BATCH_SIZE
+from bot.database.db import async_session
+from bot.database.models import User
+from bot.ratelimit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+# Результаты отправки одному получателю
+SENT = "sent"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+
+@dataclass
+class BroadcastStats:
+    """Ход и итог рассылки."""
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retries: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def count(self, status: str) -> None:
+        if status == SENT:
+            self.sent += 1
+        elif status == BLOCKED:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+    def __str__(self) -> str:
+        return (
+            f"отправлено {self.sent}, заблокировали {self.blocked}, ошибок {self.failed}, "
+            f"повторов {self.retries} за {self.elapsed:.1f} с ({self.rate:.1f} сообщ./с)"
+        )
+
+
+async def iter_subscribers(batch_size: int = BROADCAST_BATCH_SIZE) -> AsyncIterator[list[tuple[int, int]]]:
+    """Пачки (users.id, telegram_id) подписчиков с постраничным обходом по users.id."""
+    last_id = 0
+    while True:
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(User.id, User.telegram_id)
+                .where(User.receive_notifications.is_(True), User.id > last_id)
+                .order_by(User.id)
+                .limit(batch_size)
+            )).all()
+        if not rows:
+            return
+        yield [(row.id, row.telegram_id) for row in rows]
+        last_id = rows[-1].id
+
+
+async def unsubscribe(telegram_ids: list[int]) -> None:
+    """Отключает уведомления пользователям, заблокировавшим бота."""
+    if not telegram_ids:
+        return
+    async with async_session() as session:
+        await session.execute(
+            update(User)
+            .where(User.telegram_id.in_(telegram_ids))
+            .values(receive_notifications=False)
+        )
+        await session.commit()
+
+
+async def send_notification(bot: Bot, limiter: AsyncRateLimiter, chat_id: int, text: str,
+                            stats: Optional[BroadcastStats] = None) -> str:
+    """Отправляет одно сообщение с учётом общего лимита и RetryAfter."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await limiter.acquire()
+        try:
+            await bot.send_message(chat_id, text, parse_mode="HTML")
+            return SENT
+        except TelegramRetryAfter as e:
+            # Ограничение действует на весь бот — притормаживаем всех отправителей
+            limiter.pause(e.retry_after)
+            if stats:
+                stats.retries += 1
+            logger.warning(f"Telegram просит подождать {e.retry_after} с (попытка {attempt})")
+        except TelegramForbiddenError:
+            return BLOCKED
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                return BLOCKED
+            logger.error(f"Ошибка отправки пользователю {chat_id}: {e}")
+            return FAILED
+        except Exception as e:
+            logger.error(f"Ошибка отправки пользователю {chat_id}: {e}")
+            return FAILED
+    return FAILED
+
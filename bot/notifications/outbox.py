@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Optional
+from aiogram import Bot
+from sqlalchemy import select, update, func, or_, and_, exists
+from sqlalchemy.dialects.postgresql import insert
+from bot.config import BROADCAST_RATE, BROADCAST_CONCURRENCY, OUTBOX_CLAIM_SIZE, OUTBOX_LEASE_SECONDS
+from bot.database.db import async_session
+from bot.database.models import NotificationRun, NotificationOutbox
+from bot.notifications.broadcast import (
+    BroadcastStats, iter_subscribers, send_notification, unsubscribe, SENT, BLOCKED, FAILED, MAX_ATTEMPTS,
+)
+from bot.ratelimit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+CLAIMED = "claimed"
+
+# Общий для процесса ограничитель: все запуски делят один лимит Bot API
+limiter = AsyncRateLimiter(BROADCAST_RATE, burst=max(1, int(BROADCAST_RATE)))
+
+
+async def create_run(run_key: str, text: str) -> int:
+    """Создаёт запуск рассылки (или возвращает существующий с тем же ключом) и заполняет outbox."""
+    async with async_session() as session:
+        run_id = await session.scalar(
+            insert(NotificationRun)
+            .values(run_key=run_key, text=text)
+            .on_conflict_do_nothing(index_elements=[NotificationRun.run_key])
+            .returning(NotificationRun.id)
+        )
+        if run_id is None:
+            run_id = await session.scalar(select(NotificationRun.id).filter_by(run_key=run_key))
+        await session.commit()
+
+    await materialize(run_id)
+    return run_id
+
+
+async def materialize(run_id: int) -> None:
+    """Добавляет в outbox строки для всех подписчиков. Повторный вызов безопасен."""
+    async with async_session() as session:
+        if await session.scalar(select(NotificationRun.materialized_at).filter_by(id=run_id)):
+            return
+
+    total = 0
+    async for batch in iter_subscribers():
+        async with async_session() as session:
+            await session.execute(
+                insert(NotificationOutbox)
+                .values([{"run_id": run_id, "user_id": user_id, "telegram_id": telegram_id}
+                         for user_id, telegram_id in batch])
+                .on_conflict_do_nothing(constraint="uq_outbox_run_user")
+            )
+            await session.commit()
+        total += len(batch)
+
+    async with async_session() as session:
+        await session.execute(
+            update(NotificationRun).filter_by(id=run_id).values(materialized_at=func.now())
+        )
+        await session.commit()
+    logger.info(f"Рассылка {run_id}: в outbox {total} получателей")
+
+
+async def claim(run_id: int, limit: int = OUTBOX_CLAIM_SIZE) -> list[tuple[int, int]]:
+    """Захватывает пачку недоставленных строк; параллельные воркеры получают разные строки."""
+    lease_expired = func.now() - timedelta(seconds=OUTBOX_LEASE_SECONDS)
+    candidates = (
+        select(NotificationOutbox.id)
+        .where(
+            NotificationOutbox.run_id == run_id,
+            or_(
+                NotificationOutbox.status == PENDING,
+                and_(NotificationOutbox.status == CLAIMED, NotificationOutbox.claimed_at < lease_expired),
+            ),
+        )
+        .order_by(NotificationOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    async with async_session() as session:
+        rows = (await session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(candidates.scalar_subquery()))
+            .values(status=CLAIMED, claimed_at=func.now(), attempts=NotificationOutbox.attempts + 1)
+            .returning(NotificationOutbox.id, NotificationOutbox.telegram_id, NotificationOutbox.attempts)
+        )).all()
+        await session.commit()
+
+    claimed = []
+    exhausted = []
+    for row in rows:
+        # Строка уже не раз захватывалась и бросалась — больше не пытаемся
+        if row.attempts > MAX_ATTEMPTS:
+            exhausted.append(row.id)
+        else:
+            claimed.append((row.id, row.telegram_id))
+    if exhausted:
+        await mark(exhausted, FAILED)
+    return claimed
+
+
+async def mark(outbox_ids: list[int], status: str) -> None:
+    """Фиксирует итог доставки строк outbox."""
+    async with async_session() as session:
+        await session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(outbox_ids))
+            .values(status=status, sent_at=func.now() if status == SENT else None)
+        )
+        await session.commit()
+
+
+async def _finish_if_done(run_id: int) -> bool:
+    async with async_session() as session:
+        undelivered = await session.scalar(select(exists().where(
+            NotificationOutbox.run_id == run_id,
+            NotificationOutbox.status.in_((PENDING, CLAIMED)),
+        )))
+        if undelivered:
+            return False
+        await session.execute(
+            update(NotificationRun)
+            .where(NotificationRun.id == run_id, NotificationRun.completed_at.is_(None))
+            .values(completed_at=func.now())
+        )
+        await session.commit()
+        return True
+
+
+async def drain(bot: Bot, run_id: int, concurrency: int = BROADCAST_CONCURRENCY) -> BroadcastStats:
+    """Досылает запуск до конца. Несколько воркеров могут разбирать один запуск одновременно."""
+    async with async_session() as session:
+        text = await session.scalar(select(NotificationRun.text).filter_by(id=run_id))
+    stats = BroadcastStats()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(telegram_id: int) -> str:
+        async with semaphore:
+            status = await send_notification(bot, limiter, telegram_id, text, stats)
+            stats.count(status)
+            return status
+
+    while True:
+        rows = await claim(run_id)
+        if not rows:
+            break
+        statuses = await asyncio.gather(*(deliver(telegram_id) for _, telegram_id in rows))
+        # Итоги пачки записываются разом: один UPDATE на статус. После падения посреди пачки
+        # её строки будут отправлены повторно, когда истечёт аренда, — не больше OUTBOX_CLAIM_SIZE
+        by_status: dict[str, list[int]] = {}
+        for (outbox_id, _), status in zip(rows, statuses):
+            by_status.setdefault(status, []).append(outbox_id)
+        for status, outbox_ids in by_status.items():
+            await mark(outbox_ids, status)
+        await unsubscribe([telegram_id for (_, telegram_id), status in zip(rows, statuses) if status == BLOCKED])
+        logger.info(f"Рассылка {run_id}: {stats}")
+
+    if await _finish_if_done(run_id):
+        logger.info(f"Рассылка {run_id} завершена: {stats}")
+    return stats
+
+
+async def run_notification(bot: Bot, run_key: str, text: str) -> Optional[BroadcastStats]:
+    """Создаёт (или подхватывает) запуск по ключу и досылает его."""
+    run_id = await create_run(run_key, text)
+    return await drain(bot, run_id)
+
+
+async def resume_unfinished(bot: Bot) -> None:
+    """Подхватывает запуски, прерванные перезапуском или падением процесса."""
+    async with async_session() as session:
+        run_ids = (await session.scalars(
+            select(NotificationRun.id)
+            .where(NotificationRun.completed_at.is_(None))
+            .order_by(NotificationRun.id)
+        )).all()
+    for run_id in run_ids:
+        logger.info(f"Возобновление рассылки {run_id}")
+        await materialize(run_id)
+        await drain(bot, run_id)
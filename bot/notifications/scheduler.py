@@ -1,37 +1,66 @@
+import html
+import logging
+from datetime import date, datetime
+from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from bot.api_tmdb import fetch_new_movies
-from bot.config import TELEGRAM_API_TOKEN
 from aiogram import Bot
-from sqlalchemy import select
-from bot.database.db import async_session
-from bot.database.models import User
+from bot.api_tmdb import tmdb
+from bot.config import NOTIFY_HOUR, NOTIFY_MINUTE, OUTBOX_RESUME_INTERVAL
+from bot.notifications.outbox import run_notification, resume_unfinished
+from bot.database import get_pool_status, async_session
+from bot.database.crud import flush_pending_usernames
+from bot import warmer, metrics
+
+logger = logging.getLogger(__name__)
 
-bot = Bot(token=TELEGRAM_API_TOKEN)
 scheduler = AsyncIOScheduler()
+bot: Optional[Bot] = None
 
 async def send_new_movie_notifications():
-    data = await fetch_new_movies()
+    data = await tmdb.new_movies()
     movies = data.get("results", [])[:3]
     if not movies:
         return
 
     message_texts = []
     for movie in movies:
-        title = movie.get("title", "Без названия")
+        title = html.escape(movie.get("title", "Без названия"))
         release = movie.get("release_date", "неизвестно")
-        overview = movie.get("overview", "Описание отсутствует")
-        message_texts.append(f"<b>{title}</b> ({release})\n{overview[:300]}...\n")
+        overview = html.escape(movie.get("overview", "Описание отсутствует")[:300])
+        message_texts.append(f"<b>{title}</b> ({release})\n{overview}...\n")
 
     text = "\n\n".join(message_texts)
+    # Один запуск в день: другие экземпляры и перезапуски подхватывают его по ключу.
+    # Задача идёт по cron в фиксированное время, поэтому все экземпляры получают одну и ту же дату
+    await run_notification(bot, f"new_movies:{date.today().isoformat()}", f"🎬 Новые фильмы:\n\n{text}")
+
+async def resume_notifications():
+    await resume_unfinished(bot)
 
+async def log_pool_status():
+    logger.info(f"Пул соединений БД: {get_pool_status()}")
+
+async def save_usernames():
     async with async_session() as session:
-        users = (await session.execute(select(User).filter_by(receive_notifications=True))).scalars().all()
-        for user in users:
-            try:
-                await bot.send_message(user.telegram_id, f"🎬 Новые фильмы:\n\n{text}", parse_mode="HTML")
-            except Exception as e:
-                print(f"Ошибка отправки пользователю {user.telegram_id}: {e}")
-
-def start():
-    scheduler.add_job(send_new_movie_notifications, "interval", hours=24)
+        if await flush_pending_usernames(session):
+            await session.commit()
+
+# notifications=False — только прогрев кэша (для дополнительных процессов-обработчиков)
+def start(telegram_bot: Bot, notifications: bool = True):
+    global bot
+    bot = telegram_bot
+    if notifications:
+        scheduler.add_job(
+            send_new_movie_notifications, "cron", hour=NOTIFY_HOUR, minute=NOTIFY_MINUTE,
+            misfire_grace_time=3600, coalesce=True,
+        )
+        # Строки, захваченные упавшим процессом, освобождаются по истечении захвата — подбираем их,
+        # не дожидаясь следующей ежедневной рассылки. Первый запуск — сразу после старта
+        scheduler.add_job(
+            resume_notifications, "interval", seconds=OUTBOX_RESUME_INTERVAL, next_run_time=datetime.now(),
+        )
+        scheduler.add_job(log_pool_status, "interval", minutes=1)
+        scheduler.add_job(save_usernames, "interval", minutes=1)
+    warmer.schedule(scheduler)
+    metrics.watch_scheduler(scheduler)
     scheduler.start()
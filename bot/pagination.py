@@ -0,0 +1,53 @@
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# TMDB всегда отдаёт по 20 результатов на страницу (кроме последней)
+TMDB_PAGE_SIZE = 20
+
+# Загрузка страницы TMDB по номеру; ответы кэшируются в api_tmdb.fetch
+PageLoader = Callable[[int], Awaitable[dict]]
+
+
+@dataclass
+class Window:
+    """Страница бота: фильмы и есть ли что показать дальше."""
+    movies: list[dict]
+    has_more: bool
+    error: bool = False
+
+
+def locate(page: int, per_page: int) -> tuple[int, int]:
+    """Страница TMDB и смещение в ней для первого фильма страницы бота (страницы с 1)."""
+    start = (page - 1) * per_page
+    return start // TMDB_PAGE_SIZE + 1, start % TMDB_PAGE_SIZE
+
+
+async def get_window(load: PageLoader, page: int, per_page: int) -> Window:
+    """Нарезает закэшированные страницы TMDB на страницы бота по per_page фильмов.
+
+    К TMDB идём, только когда текущая страница TMDB закончилась; если страница бота
+    попадает на стык, её хвост берётся из следующей страницы TMDB.
+    """
+    tmdb_page, offset = locate(max(page, 1), per_page)
+    movies: list[dict] = []
+
+    while True:
+        data = await load(tmdb_page)
+        if "error" in data:
+            return Window(movies, has_more=False, error=not movies)
+        results = data.get("results") or []
+        total_pages = min(data.get("total_pages") or tmdb_page, 500)  # дальше 500-й страницы TMDB не отдаёт
+
+        need = per_page - len(movies)
+        movies.extend(results[offset:offset + need])
+        if offset + need < len(results):
+            return Window(movies, has_more=True)
+        if not results or tmdb_page >= total_pages:
+            return Window(movies, has_more=False)
+        if len(movies) == per_page:
+            return Window(movies, has_more=True)
+        tmdb_page += 1
+        offset = 0
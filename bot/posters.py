@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from typing import Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InputMediaPhoto
+from bot.cache import TTLCache
+from bot.config import POSTER_CACHE_SIZE
+from bot.database.db import async_session
+from bot.database.crud import get_poster_file_id, get_poster_file_ids, save_poster_file_id, delete_poster_file_id
+
+logger = logging.getLogger(__name__)
+
+POSTER_BASE_URL = "https://image.tmdb.org/t/p/w500"
+THUMBNAIL_BASE_URL = "https://image.tmdb.org/t/p/w92"
+
+# Пустая строка — «в базе нет file_id», чтобы не ходить в БД за каждым новым постером
+_NO_FILE_ID = ""
+_MISS_TTL = 300
+
+# Кэш poster_path → file_id перед таблицей poster_files
+_file_ids = TTLCache(maxsize=POSTER_CACHE_SIZE, ttl=7 * 24 * 3600)
+_background_tasks: set[asyncio.Task] = set()
+
+
+def poster_url(poster_path: Optional[str]) -> Optional[str]:
+    """Ссылка на постер в CDN TMDB."""
+    return f"{POSTER_BASE_URL}{poster_path}" if poster_path else None
+
+
+def thumbnail_url(poster_path: Optional[str]) -> Optional[str]:
+    """Маленькое превью постера (для inline-режима)."""
+    return f"{THUMBNAIL_BASE_URL}{poster_path}" if poster_path else None
+
+
+async def cached_file_id(poster_path: str) -> Optional[str]:
+    """file_id постера из памяти или из базы; None, если постер ещё не загружали."""
+    file_id = _file_ids.get(poster_path)
+    if file_id is None:
+        try:
+            async with async_session() as session:
+                file_id = await get_poster_file_id(session, poster_path)
+        except Exception as e:
+            logger.error(f"Ошибка при чтении file_id постера {poster_path}: {e}")
+            return None
+        _file_ids.set(poster_path, file_id or _NO_FILE_ID, None if file_id else _MISS_TTL)
+    return file_id or None
+
+
+async def preload_file_ids(poster_paths: list[str]) -> int:
+    """Подтягивает из базы file_id постеров, которых ещё нет в памяти (одним запросом)."""
+    missing = [path for path in dict.fromkeys(poster_paths) if path and path not in _file_ids]
+    if not missing:
+        return 0
+    async with async_session() as session:
+        found = await get_poster_file_ids(session, missing)
+    for path in missing:
+        file_id = found.get(path)
+        _file_ids.set(path, file_id or _NO_FILE_ID, None if file_id else _MISS_TTL)
+    return len(found)
+
+
+async def resolve_photo(poster_path: str) -> str:
+    """Что передать в send_photo: сохранённый file_id или ссылку на постер."""
+    return await cached_file_id(poster_path) or poster_url(poster_path)
+
+
+async def _save(poster_path: str, file_id: str) -> None:
+    try:
+        async with async_session() as session:
+            await save_poster_file_id(session, poster_path, file_id)
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении file_id постера {poster_path}: {e}")
+
+
+async def _forget(poster_path: str) -> None:
+    _file_ids.pop(poster_path)
+    try:
+        async with async_session() as session:
+            await delete_poster_file_id(session, poster_path)
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при удалении file_id постера {poster_path}: {e}")
+
+
+def remember_file_id(poster_path: str, message: Message) -> None:
+    """Запоминает file_id из отправленного сообщения с фото."""
+    if not message.photo:
+        return
+    file_id = message.photo[-1].file_id
+    if _file_ids.get(poster_path) == file_id:
+        return
+    _file_ids.set(poster_path, file_id)
+    task = asyncio.create_task(_save(poster_path, file_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def send_poster(bot: Bot, chat_id: int, poster_path: str, **kwargs) -> Message:
+    """Отправляет постер, по возможности по file_id, и запоминает file_id для следующих отправок."""
+    file_id = await cached_file_id(poster_path)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if "file" not in str(e).lower():
+                raise
+            # file_id мог стать недействительным — забываем его и шлём по ссылке
+            logger.warning(f"file_id постера {poster_path} не принят Telegram: {e}")
+            await _forget(poster_path)
+
+    message = await bot.send_photo(chat_id, photo=poster_url(poster_path), **kwargs)
+    remember_file_id(poster_path, message)
+    return message
+
+
+async def send_poster_album(bot: Bot, chat_id: int, items: list[tuple[str, str]], parse_mode: str = "HTML") -> list[Message]:
+    """Отправляет постеры одним альбомом (sendMediaGroup); items — пары (poster_path, подпись)."""
+    messages = []
+    for start in range(0, len(items), 10):  # в альбоме не больше 10 фото
+        chunk = items[start:start + 10]
+        if len(chunk) == 1:  # альбом должен содержать минимум 2 фото
+            path, caption = chunk[0]
+            messages.append(await send_poster(bot, chat_id, path, caption=caption, parse_mode=parse_mode))
+            continue
+        # file_id всего альбома — одним запросом к базе; что не нашлось, отправляем по ссылке
+        try:
+            await preload_file_ids([path for path, _ in chunk])
+        except Exception as e:
+            logger.error(f"Ошибка при чтении file_id постеров альбома: {e}")
+        photos = [_file_ids.get(path) or poster_url(path) for path, _ in chunk]
+        try:
+            sent = await bot.send_media_group(chat_id, media=_album_media(chunk, photos, parse_mode))
+        except TelegramBadRequest as e:
+            reused = [path for (path, _), photo in zip(chunk, photos) if photo != poster_url(path)]
+            if not reused or "file" not in str(e).lower():
+                raise
+            # Какой именно file_id устарел, неизвестно — забываем все и шлём по ссылкам
+            logger.warning(f"Альбом с сохранёнными file_id не принят Telegram: {e}")
+            for path in reused:
+                await _forget(path)
+            photos = [poster_url(path) for path, _ in chunk]
+            sent = await bot.send_media_group(chat_id, media=_album_media(chunk, photos, parse_mode))
+
+        for (path, _), message in zip(chunk, sent):
+            remember_file_id(path, message)
+        messages.extend(sent)
+    return messages
+
+
+def _album_media(items: list[tuple[str, str]], photos: list[str], parse_mode: str) -> list[InputMediaPhoto]:
+    return [
+        InputMediaPhoto(media=photo, caption=caption, parse_mode=parse_mode)
+        for (_, caption), photo in zip(items, photos)
+    ]
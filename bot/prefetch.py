@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from bot.config import PREFETCH_CONCURRENCY
+from bot.pagination import PageLoader, get_window
+from bot.posters import preload_file_ids
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Фоновая загрузка следующей страницы бота, пока пользователь смотрит текущую.
+
+    Запланированных загрузок не больше concurrency: если бюджет исчерпан, предзагрузка
+    просто пропускается. На чат — не больше одной задачи; новая заменяет старую.
+    """
+
+    def __init__(self, concurrency: int = PREFETCH_CONCURRENCY):
+        self._concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self._tasks: dict[int, asyncio.Task] = {}
+        self.started = 0
+        self.skipped = 0
+
+    def schedule(self, chat_id: int, load: PageLoader, page: int, per_page: int) -> None:
+        """Запланировать загрузку страницы бота page (обычно текущая + 1)."""
+        self.cancel(chat_id)
+        if self._concurrency <= 0:
+            return
+        if len(self._tasks) >= self._concurrency:
+            # Предзагрузка — низкий приоритет: не копим очередь под нагрузкой.
+            # Считаем все запланированные задачи, а не только занявшие семафор
+            self.skipped += 1
+            return
+        self.started += 1
+        task = asyncio.create_task(self._run(load, page, per_page))
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda t: self._done(chat_id, t))
+
+    def cancel(self, chat_id: int) -> None:
+        """Пользователь ушёл со списка — предзагрузка больше не нужна."""
+        task = self._tasks.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _run(self, load: PageLoader, page: int, per_page: int) -> None:
+        async with self._semaphore:
+            # Запрос к TMDB не прерываем: его же может ждать другой пользователь,
+            # а результат в любом случае ляжет в кэш
+            window = await asyncio.shield(get_window(load, page, per_page))
+            await preload_file_ids([movie.get("poster_path") for movie in window.movies])
+
+    def _done(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._tasks.get(chat_id) is task:
+            del self._tasks[chat_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Ошибка предзагрузки для чата {chat_id}: {task.exception()}")
+
+
+prefetcher = Prefetcher()
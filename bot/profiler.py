@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from types import FrameType
+from typing import Optional
+from bot.config import PROFILE_DIR, PROFILE_INTERVAL_MS
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик потока event loop.
+
+    Отдельный поток раз в interval снимает стек потока цикла событий через sys._current_frames();
+    результат — collapsed stacks («кадр;кадр;кадр число»), которые принимают flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, directory: str = PROFILE_DIR):
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float) -> None:
+        """Запускает профилирование потока, из которого вызван (поток event loop)."""
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+        self._stop.clear()
+        self._stacks = Counter()
+        target = threading.get_ident()
+        self._thread = threading.Thread(
+            target=self._sample, args=(target, time.monotonic() + seconds), name="profiler", daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _sample(self, target: int, deadline: float) -> None:
+        while time.monotonic() < deadline and not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                self._stacks[_collapse(frame)] += 1
+            del frame
+
+    async def wait(self) -> str:
+        """Дожидается окончания профилирования и сохраняет профиль; возвращает путь к файлу."""
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile-{datetime.now():%Y%m%d-%H%M%S}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    @property
+    def samples(self) -> int:
+        return sum(self._stacks.values())
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,153 @@
+import heapq
+import logging
+import re
+import time
+from collections import Counter
+from typing import Iterable
+from sqlalchemy import select
+from bot.api_tmdb import add_results_hook
+from bot.database.db import async_session
+from bot.database.models import Movie
+
+logger = logging.getLogger(__name__)
+
+MIN_SIMILARITY = 0.6  # доля триграмм запроса, которые должны найтись в названии
+# Сколько кандидатов ранжируется полностью: у коротких и частых запросов их тысячи,
+# а показывается не больше страницы
+MAX_SCORED = 500
+_NON_WORD = re.compile(r"[^\w]+")
+# Поля фильма, нужные для вывода карточки
+_MOVIE_FIELDS = ("id", "title", "original_title", "overview", "poster_path", "release_date", "popularity", "vote_average")
+
+
+def fold(text: str) -> str:
+    """Нормализация для поиска: регистр, ё → е, пунктуация → пробел."""
+    return " ".join(_NON_WORD.sub(" ", text.lower().replace("ё", "е")).split())
+
+
+def trigrams(folded: str) -> set[str]:
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Индекс названий фильмов в памяти: префиксы слов и триграммы, ранжирование по популярности."""
+
+    def __init__(self):
+        self._movies: dict[int, dict] = {}
+        self._names: dict[int, tuple[str, ...]] = {}
+        self._trigrams: dict[str, set[int]] = {}
+        self._short_prefixes: dict[str, set[int]] = {}  # префиксы слов из 1–2 символов
+        self._short_ranked: dict[str, list[int]] = {}    # те же списки по убыванию популярности (собираются по запросу)
+        self._popularity: dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._movies)
+
+    def add(self, movies: Iterable[dict]) -> None:
+        for movie in movies:
+            movie_id = movie.get("id")
+            title = movie.get("title")
+            if not movie_id or not title:
+                continue
+            names = tuple(dict.fromkeys(
+                fold(name) for name in (title, movie.get("original_title")) if name and fold(name)
+            ))
+            if self._names.get(movie_id) != names:
+                self._remove_postings(movie_id)
+                self._add_postings(movie_id, names)
+                self._names[movie_id] = names
+            self._movies[movie_id] = {field: movie.get(field) for field in _MOVIE_FIELDS}
+            popularity = movie.get("popularity") or 0
+            if self._popularity.get(movie_id) != popularity:
+                self._popularity[movie_id] = popularity
+                for prefix in self._postings(names)[1]:
+                    self._short_ranked.pop(prefix, None)
+
+    def _postings(self, names: tuple[str, ...]) -> tuple[set[str], set[str]]:
+        grams = set().union(*(trigrams(name) for name in names))
+        prefixes = {word[:n] for name in names for word in name.split() for n in (1, 2)}
+        return grams, prefixes
+
+    def _add_postings(self, movie_id: int, names: tuple[str, ...]) -> None:
+        grams, prefixes = self._postings(names)
+        for gram in grams:
+            self._trigrams.setdefault(gram, set()).add(movie_id)
+        for prefix in prefixes:
+            self._short_prefixes.setdefault(prefix, set()).add(movie_id)
+            self._short_ranked.pop(prefix, None)
+
+    def _remove_postings(self, movie_id: int) -> None:
+        names = self._names.get(movie_id)
+        if not names:
+            return
+        grams, prefixes = self._postings(names)
+        for gram in grams:
+            self._trigrams[gram].discard(movie_id)
+        for prefix in prefixes:
+            self._short_prefixes[prefix].discard(movie_id)
+            self._short_ranked.pop(prefix, None)
+
+    def _ranked_prefix(self, prefix: str) -> list[int]:
+        ranked = self._short_ranked.get(prefix)
+        if ranked is None:
+            ranked = sorted(self._short_prefixes.get(prefix, ()), key=self._popularity.__getitem__, reverse=True)
+            self._short_ranked[prefix] = ranked
+        return ranked
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        """Фильмы, подходящие под запрос: сначала совпадения с начала названия, затем по сходству и популярности."""
+        folded = fold(query)
+        if not folded:
+            return []
+
+        if len(folded) < 3:
+            # Короткий запрос совпадает с началом слова у всех кандидатов — берём самые популярные
+            candidates = dict.fromkeys(self._ranked_prefix(folded)[:MAX_SCORED], 1.0)
+        else:
+            query_grams = trigrams(folded)
+            counts = Counter()
+            for gram in query_grams:
+                counts.update(self._trigrams.get(gram, ()))
+            needed = MIN_SIMILARITY * len(query_grams)
+            matched = [movie_id for movie_id, count in counts.items() if count >= needed]
+            if len(matched) > MAX_SCORED:
+                matched = heapq.nlargest(MAX_SCORED, matched, key=counts.__getitem__)
+            candidates = {movie_id: round(counts[movie_id] / len(query_grams), 1) for movie_id in matched}
+
+        names, popularity = self._names, self._popularity
+        best = heapq.nsmallest(
+            limit, candidates,
+            key=lambda movie_id: (
+                -self._match_rank(folded, names[movie_id]), -candidates[movie_id], -popularity[movie_id],
+            ),
+        )
+        return [self._movies[movie_id] for movie_id in best]
+
+    @staticmethod
+    def _match_rank(folded: str, names: tuple[str, ...]) -> int:
+        # 3 — название совпало, 2 — начинается с запроса, 1 — запрос с начала какого-то слова
+        rank = 0
+        for name in names:
+            if name == folded:
+                return 3
+            if name.startswith(folded):
+                rank = max(rank, 2)
+            elif f" {folded}" in f" {name}":
+                rank = max(rank, 1)
+        return rank
+
+
+async def load_catalog(index: "TitleIndex") -> int:
+    """Заполняет индекс фильмами из локального каталога (при старте)."""
+    started = time.monotonic()
+    async with async_session() as session:
+        rows = await session.execute(select(*(getattr(Movie, field) for field in _MOVIE_FIELDS)))
+        index.add(row._asdict() for row in rows)
+    logger.info(f"Индекс названий: {len(index)} фильмов за {time.monotonic() - started:.2f} с")
+    return len(index)
+
+
+# Общий индекс процесса; пополняется каждым ответом TMDB
+title_index = TitleIndex()
+add_results_hook(title_index.add)
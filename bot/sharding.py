@@ -0,0 +1,396 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import queue as queue_module
+import os
+import time
+from multiprocessing.connection import Connection
+from typing import Optional
+import aiohttp
+from aiohttp import web
+from bot.config import (
+    TELEGRAM_API_TOKEN, TELEGRAM_API_URL, BOT_MODE, SHARD_WORKERS, SHARD_QUEUE_SIZE, UPDATE_WORKERS, STATE_BACKEND,
+    WEBHOOK_HOST, WEBHOOK_PORT, TMDB_SHARED_CACHE, METRICS_PORT,
+)
+from bot import metrics
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY = 1.0     # пауза перед перезапуском упавшего процесса
+POLL_TIMEOUT = 30       # long polling getUpdates, секунд
+PUT_WARN_INTERVAL = 10.0  # как часто напоминать в логе, что очередь процесса не разбирается
+MAX_DELIVERIES = 2      # обновление, с которым процесс падал столько раз, больше не передаётся
+
+
+class HashRing:
+    """Консистентное хеширование chat_id на процессы-обработчики."""
+
+    def __init__(self, nodes: int, replicas: int = 100):
+        self._ring: list[tuple[int, int]] = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in range(nodes) for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def node_for(self, chat_id: int) -> int:
+        index = bisect.bisect(self._keys, self._hash(str(chat_id))) % len(self._ring)
+        return self._ring[index][1]
+
+
+def chat_id_of(raw_update: dict) -> int:
+    """Быстро достаёт chat_id из необработанного обновления, без разбора в модели aiogram."""
+    for key, value in raw_update.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        if "from" in value:
+            return value["from"]["id"]
+    return raw_update.get("update_id", 0)
+
+
+class ShardRouter:
+    """Раскладывает обновления по очередям процессов; один чат всегда попадает в один процесс.
+
+    Переданное обновление хранится, пока процесс не подтвердит его обработку: если процесс упадёт,
+    неподтверждённые обновления передаются перезапущенному процессу.
+    """
+
+    def __init__(self, queues: list, queue_size: int = SHARD_QUEUE_SIZE):
+        self.queues = queues
+        self.queue_size = queue_size
+        self.ring = HashRing(len(queues))
+        self.accepted = 0
+        self.rejected = 0
+        # update_id → [shard, обновление, число передач]
+        self.pending: dict[int, list] = {}
+        self._pending_counts = [0] * len(queues)
+        self._waiters: dict[int, asyncio.Future] = {}
+        metrics.on_scrape(self._export_depths)
+
+    def replace(self, shard: int, new_queue) -> None:
+        """Подменяет очередь процесса (после перезапуска); хеш-кольцо не меняется."""
+        self.queues[shard] = new_queue
+
+    def _export_depths(self) -> None:
+        for index, depth in enumerate(self.snapshot()["queue_depths"]):
+            metrics.UPDATE_QUEUE_DEPTH.labels(f"shard-{index}").set(depth)
+
+    def submit(self, raw_update: dict) -> bool:
+        update_id = raw_update["update_id"]
+        if update_id in self.pending:
+            return True  # повторная доставка того же обновления — оно уже в работе
+        shard = self.ring.node_for(chat_id_of(raw_update))
+        # Лимит — на все неподтверждённые обновления процесса, а не только на лежащие в очереди
+        if self._pending_counts[shard] >= self.queue_size:
+            self.rejected += 1
+            return False
+        try:
+            self.queues[shard].put_nowait(raw_update)
+        except queue_module.Full:
+            self.rejected += 1
+            return False
+        self.pending[update_id] = [shard, raw_update, 1]
+        self._pending_counts[shard] += 1
+        self.accepted += 1
+        return True
+
+    def ack(self, shard: int, update_id: int) -> None:
+        """Процесс обработал обновление."""
+        if self.pending.pop(update_id, None) is not None:
+            self._pending_counts[shard] -= 1
+        waiter = self._waiters.pop(update_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def requeue(self, shard: int) -> tuple[int, int]:
+        """Передаёт неподтверждённые обновления в (новую) очередь процесса; возвращает (передано, потеряно)."""
+        requeued = lost = 0
+        for update_id, entry in sorted((key, value) for key, value in self.pending.items() if value[0] == shard):
+            _, raw_update, deliveries = entry
+            if deliveries < MAX_DELIVERIES:
+                try:
+                    self.queues[shard].put_nowait(raw_update)
+                    entry[2] += 1
+                    requeued += 1
+                    continue
+                except queue_module.Full:
+                    pass
+            logger.error(f"Обновление {update_id} потеряно: процесс shard-{shard} упал при его обработке")
+            lost += 1
+            self.ack(shard, update_id)
+        metrics.SHARD_UPDATES_REQUEUED.labels(str(shard)).inc(requeued)
+        metrics.SHARD_UPDATES_LOST.labels(str(shard)).inc(lost)
+        return requeued, lost
+
+    async def put(self, raw_update: dict) -> None:
+        """Ставит обновление в очередь, дожидаясь места (для polling).
+
+        Обновление не отбрасывается: пока оно не в очереди, polling стоит и offset не сдвигается,
+        так что Telegram хранит его и все следующие. Упавший процесс перезапускается с новой очередью.
+        """
+        waiting_since = time.monotonic()
+        warned_at = waiting_since
+        while not self.submit(raw_update):
+            now = time.monotonic()
+            if now - warned_at >= PUT_WARN_INTERVAL:
+                warned_at = now
+                logger.warning(
+                    f"Очередь процесса переполнена {now - waiting_since:.0f} с, приём обновлений приостановлен: "
+                    f"{self.snapshot()}"
+                )
+            await asyncio.sleep(0.1)
+
+    async def process(self, raw_update: dict) -> bool:
+        """Приём обновления webhook: ставит его в очередь и ждёт подтверждения от процесса."""
+        if not self.submit(raw_update):
+            return False
+        update_id = raw_update["update_id"]
+        if update_id in self.pending:
+            waiter = self._waiters.setdefault(update_id, asyncio.get_running_loop().create_future())
+            await asyncio.shield(waiter)
+        return True
+
+    def snapshot(self) -> dict:
+        depths = []
+        for q in self.queues:
+            try:
+                depths.append(q.qsize())
+            except NotImplementedError:  # macOS
+                depths.append(-1)
+        return {
+            "queue_depths": depths, "pending": self._pending_counts, "accepted": self.accepted, "rejected": self.rejected,
+        }
+
+
+# --- Процесс-обработчик ---
+
+async def _consume(index: int, updates, acks) -> None:
+    # Импорт здесь: процесс запускается через spawn и собирает бота сам
+    from bot.main import create_bot_and_dispatcher
+    from bot.api_tmdb import tmdb
+    from bot.notifications import scheduler
+    from bot.search_index import title_index, load_catalog
+
+    bot, dp = create_bot_and_dispatcher()
+    await tmdb.start()
+    await load_catalog(title_index)
+    if index == 0:
+        scheduler.start(bot)  # рассылки запускает только первый процесс
+    elif not TMDB_SHARED_CACHE:
+        scheduler.start(bot, notifications=False)  # кэш TMDB у каждого процесса свой — греем каждый
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(UPDATE_WORKERS)
+    # chat_id → [lock, число обновлений чата в работе]
+    chat_locks: dict[int, list] = {}
+    tasks: set[asyncio.Task] = set()
+
+    async def process(raw_update: dict) -> None:
+        chat_id = chat_id_of(raw_update)
+        entry = chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # Lock отдаёт очередь в порядке ожидания — обновления одного чата идут по порядку
+            async with entry[0], semaphore:
+                await dp.feed_raw_update(bot, raw_update)
+        except Exception as e:
+            logger.exception(f"[shard {index}] Ошибка обработки обновления: {e}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del chat_locks[chat_id]
+        # Подтверждение: обработанное обновление не нужно передавать заново после падения
+        acks.send(raw_update["update_id"])
+
+    logger.info(f"[shard {index}] Процесс-обработчик запущен")
+    try:
+        while True:
+            raw_update = await loop.run_in_executor(None, updates.get)
+            if raw_update is None:  # сигнал остановки
+                break
+            task = asyncio.create_task(process(raw_update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        if scheduler.scheduler.running:
+            scheduler.scheduler.shutdown(wait=False)
+        await dp.storage.close()
+        await tmdb.close()
+        await bot.session.close()
+
+
+def _worker_process(index: int, updates, acks) -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s | %(levelname)s | shard-{index} | %(name)s | %(message)s",
+    )
+    try:
+        asyncio.run(_consume(index, updates, acks))
+    except KeyboardInterrupt:
+        pass
+
+
+# --- Приём обновлений и надзор ---
+
+class Supervisor:
+    """Запускает N процессов-обработчиков и перезапускает упавшие."""
+
+    def __init__(self, workers: int = SHARD_WORKERS, queue_size: int = SHARD_QUEUE_SIZE):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.queue_size = queue_size
+        self.queues = [self.ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processes: list[Optional[multiprocessing.Process]] = [None] * workers
+        # Канал подтверждений от процесса; у каждого процесса свой и пересоздаётся при перезапуске
+        self.acks: list[Optional[Connection]] = [None] * workers
+        self.router = ShardRouter(self.queues, queue_size)
+        self.restarts = 0
+
+    def _spawn(self, index: int) -> None:
+        receiver, sender = self.ctx.Pipe(duplex=False)
+        process = self.ctx.Process(
+            target=_worker_process, args=(index, self.queues[index], sender),
+            name=f"filmbot-shard-{index}", daemon=True,
+        )
+        process.start()
+        sender.close()  # у нас остаётся только чтение: после смерти процесса канал вернёт EOF
+        self.processes[index] = process
+        self.acks[index] = receiver
+        asyncio.get_running_loop().add_reader(receiver.fileno(), self._read_acks, index)
+
+    def _read_acks(self, index: int) -> None:
+        receiver = self.acks[index]
+        try:
+            while receiver.poll():
+                self.router.ack(index, receiver.recv())
+        except (EOFError, OSError):
+            self._close_acks(index)
+
+    def _close_acks(self, index: int) -> None:
+        receiver = self.acks[index]
+        if receiver is None:
+            return
+        asyncio.get_running_loop().remove_reader(receiver.fileno())
+        receiver.close()
+        self.acks[index] = None
+
+    def start(self) -> None:
+        for index in range(len(self.queues)):
+            self._spawn(index)
+
+    def _replace_queue(self, index: int) -> None:
+        # Убитый процесс почти всегда ждал в updates.get и унёс с собой блокировку чтения очереди:
+        # из старой очереди уже не прочитать. Зато всё неподтверждённое есть у роутера —
+        # передаём его в новую очередь.
+        if self.acks[index] is not None:
+            self._read_acks(index)  # подтверждения, пришедшие перед смертью процесса
+            self._close_acks(index)
+        old = self.queues[index]
+        self.router.replace(index, self.ctx.Queue(maxsize=self.queue_size))
+        old.close()
+        old.cancel_join_thread()
+        requeued, lost = self.router.requeue(index)
+        logger.warning(f"shard-{index}: передано заново {requeued} обновлений, потеряно {lost}")
+
+    async def watch(self) -> None:
+        while True:
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Процесс shard-{index} завершился (код {process.exitcode}), перезапуск")
+                    self.restarts += 1
+                    self._replace_queue(index)
+                    await asyncio.sleep(RESTART_DELAY)
+                    self._spawn(index)
+            await asyncio.sleep(1)
+
+    def stop(self, timeout: float = 30) -> None:
+        for q in self.queues:
+            try:
+                q.put(None, timeout=timeout)
+            except queue_module.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+
+
+async def poll_updates(router: ShardRouter, allowed_updates: list[str]) -> None:
+    """Long polling getUpdates без разбора обновлений: разбирают процессы-обработчики."""
+    url = f"{(TELEGRAM_API_URL or 'https://api.telegram.org').rstrip('/')}/bot{TELEGRAM_API_TOKEN}/getUpdates"
+    offset = None
+    timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            params = {"timeout": POLL_TIMEOUT, "allowed_updates": json.dumps(allowed_updates)}
+            if offset is not None:
+                params["offset"] = offset
+            try:
+                async with session.get(url, params=params) as response:
+                    payload = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not payload.get("ok"):
+                logger.error(f"getUpdates вернул ошибку: {payload}")
+                await asyncio.sleep(payload.get("parameters", {}).get("retry_after", 1))
+                continue
+            for raw_update in payload["result"]:
+                await router.put(raw_update)
+                # Смещаем offset только после постановки в очередь — иначе обновление потеряется
+                offset = raw_update["update_id"] + 1
+
+
+async def run_sharded() -> None:
+    """Точка входа многопроцессного режима: приём обновлений + процессы-обработчики."""
+    from bot.commands import set_commands
+    from bot.database import init_db
+    from bot.main import create_bot_and_dispatcher
+    from bot.webhook import create_app, register_webhook
+
+    if STATE_BACKEND == "memory":
+        logger.warning("SHARD_WORKERS > 1 с STATE_BACKEND=memory: состояние не переживёт перезапуск процесса.")
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        logger.warning("Без PROMETHEUS_MULTIPROC_DIR /metrics покажет только процесс приёма обновлений.")
+
+    await init_db()
+    bot, dp = create_bot_and_dispatcher()
+    allowed_updates = dp.resolve_used_update_types()
+    await set_commands(bot)
+
+    supervisor = Supervisor()
+    supervisor.start()
+    watcher = asyncio.create_task(supervisor.watch())
+    runner: Optional[web.AppRunner] = None
+    try:
+        if BOT_MODE == "webhook":
+            runner = web.AppRunner(create_app(supervisor.router))
+            await runner.setup()
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            await register_webhook(bot, allowed_updates)
+            await bot.session.close()
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook(drop_pending_updates=False)
+            await bot.session.close()
+            if METRICS_PORT:
+                runner = await metrics.serve()
+            await poll_updates(supervisor.router, allowed_updates)
+    finally:
+        watcher.cancel()
+        if runner is not None:
+            await runner.cleanup()
+        await asyncio.get_running_loop().run_in_executor(None, supervisor.stop)
+        await bot.session.close()
@@ -0,0 +1,118 @@
+import copy
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType, DefaultKeyBuilder
+from bot.cache import TTLCache
+from bot.config import STATE_BACKEND, REDIS_URL, STATE_TTL, STATE_MAX_ENTRIES
+
+
+class StateStore(ABC):
+    """Хранилище состояния пользователей с ограниченным временем жизни записей."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Хранилище в памяти процесса: LRU с ограничением размера и TTL."""
+
+    def __init__(self, maxsize: int = STATE_MAX_ENTRIES, ttl: int = STATE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[Any]:
+        # Копия — чтобы изменения без set() не попадали в хранилище, как и у Redis
+        return copy.deepcopy(self._cache.get(key))
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        self._cache.set(key, copy.deepcopy(value), ttl)
+
+    async def delete(self, key: str) -> None:
+        self._cache.pop(key)
+
+
+class RedisStateStore(StateStore):
+    """Общее хранилище в Redis (или совместимом сервере); значения хранятся в JSON."""
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = STATE_TTL, prefix: str = "filmbot"):
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError("Для STATE_BACKEND=redis установите пакет redis.") from e
+        self.redis = Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.redis.get(self._key(key))
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        await self.redis.set(self._key(key), json.dumps(value, ensure_ascii=False), ex=ttl or self.ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.redis.delete(self._key(key))
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def create_state_store(backend: str = STATE_BACKEND) -> StateStore:
+    if backend == "redis":
+        return RedisStateStore()
+    if backend == "memory":
+        return MemoryStateStore()
+    raise ValueError(f"Неизвестное хранилище состояния: {backend}")
+
+
+class StateStoreStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх StateStore."""
+
+    def __init__(self, store: StateStore, ttl: int = STATE_TTL):
+        self.store = store
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key, "state")
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self.store.delete(storage_key)
+        else:
+            await self.store.set(storage_key, state, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.store.get(self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key, "data")
+        if not data:
+            await self.store.delete(storage_key)
+        else:
+            await self.store.set(storage_key, data, self.ttl)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return await self.store.get(self.key_builder.build(key, "data")) or {}
+
+    async def close(self) -> None:
+        await self.store.close()
+
+
+# Общее хранилище состояния процесса
+state_store = create_state_store()
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject, Update
+from bot.config import TRACE_FILE, TRACE_MAX_BYTES, TRACE_SLOW_MS, TRACE_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """Участок работы внутри обработки обновления; дочерние участки — вложенные вызовы."""
+
+    __slots__ = ("name", "attrs", "started", "duration", "children")
+
+    def __init__(self, name: str, attrs: Optional[dict] = None, started: Optional[float] = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.started = time.perf_counter() if started is None else started
+        self.duration: Optional[float] = None
+        self.children: list["Span"] = []
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started
+
+    def to_dict(self, origin: float) -> dict:
+        return {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 3),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            **({"attrs": self.attrs} if self.attrs else {}),
+            **({"children": [child.to_dict(origin) for child in self.children]} if self.children else {}),
+        }
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+def _attach(child: Span) -> bool:
+    parent = _current.get()
+    # Фоновые задачи наследуют контекст, но переживают обновление — к закрытому участку не цепляемся
+    if parent is None or parent.duration is not None:
+        return False
+    parent.children.append(child)
+    return True
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """Дочерний участок текущей трассы; вне трассы ничего не делает."""
+    child = Span(name, attrs)
+    if not _attach(child):
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current.reset(token)
+
+
+def annotate(**attrs) -> None:
+    """Добавляет атрибуты текущему участку (например, результат обращения к кэшу)."""
+    current = _current.get()
+    if current is not None and current.duration is None:
+        current.attrs.update(attrs)
+
+
+def record(name: str, started: float, duration: float, **attrs) -> None:
+    """Добавляет уже завершённый участок (когда начало и конец приходят из разных колбэков)."""
+    child = Span(name, attrs, started)
+    child.duration = duration
+    _attach(child)
+
+
+def summarize(root: Span) -> str:
+    """Сводка по всем вложенным участкам: имя ×число, суммарное время."""
+    totals: dict[str, list] = defaultdict(lambda: [0, 0.0])
+    stack = list(root.children)
+    while stack:
+        item = stack.pop()
+        totals[item.name][0] += 1
+        totals[item.name][1] += item.duration or 0.0
+        stack.extend(item.children)
+    parts = sorted(totals.items(), key=lambda entry: -entry[1][1])
+    return ", ".join(f"{name} ×{count} {seconds * 1000:.0f} мс" for name, (count, seconds) in parts) or "без вложенных участков"
+
+
+class JsonLinesExporter:
+    """Пишет трассы по одной JSON-строке в файл; при max_bytes файл сменяется, хранится одна прошлая копия."""
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+
+    def export(self, root: Span, slow: bool) -> None:
+        line = json.dumps({
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "trace_id": uuid.uuid4().hex[:16],
+            "slow": slow,
+            "root": root.to_dict(root.started),
+        }, ensure_ascii=False, default=str)
+        try:
+            if self._file is not None and self.max_bytes and self._file.tell() >= self.max_bytes:
+                self.close()
+                os.replace(self.path, f"{self.path}.1")
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line + "\n")
+        except OSError as e:
+            logger.error(f"Не удалось записать трассу в {self.path}: {e}")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+exporter = JsonLinesExporter()
+
+
+def _describe(update: Update) -> dict:
+    event_type = update.event_type
+    event = update.event
+    user = getattr(event, "from_user", None)
+    attrs = {"update_id": update.update_id, "type": event_type, "user_id": user.id if user else None}
+    data = getattr(event, "data", None) or getattr(event, "text", None)
+    if data:
+        attrs["payload"] = data[:64]
+    return attrs
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: корневой участок на каждое обновление."""
+
+    def __init__(self, slow_ms: float = TRACE_SLOW_MS, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.slow = slow_ms / 1000
+        self.sample_rate = sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        root = Span("update", _describe(event) if isinstance(event, Update) else {})
+        token = _current.set(root)
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            root.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            root.finish()
+            slow = root.duration >= self.slow
+            if slow:
+                logger.warning(
+                    f"Медленное обновление {root.attrs.get('update_id')} ({root.attrs.get('type')}): "
+                    f"{root.duration * 1000:.0f} мс — {summarize(root)}"
+                )
+            if slow or (self.sample_rate and random.random() < self.sample_rate):
+                exporter.export(root, slow)
+
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """Участок на каждый вызов Bot API (sendMessage, sendPhoto, ...)."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with span(f"bot.{method.__api_method__}"):
+            return await make_request(bot, method)
@@ -0,0 +1,217 @@
+import html
+import logging
+from functools import lru_cache
+from typing import Optional, Union
+from aiogram import Bot
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton,
+    InlineQueryResultArticle, InputTextMessageContent,
+)
+from bot.api_tmdb import GENRES
+from bot.config import LIST_RENDER_MODE, CARD_CACHE_SIZE
+from bot.posters import send_poster, send_poster_album, thumbnail_url
+
+logger = logging.getLogger(__name__)
+
+# Все тексты с фильмами отправляются в HTML
+PARSE_MODE = "HTML"
+
+# Действие кнопки под фильмом
+ACTION_FAVORITE = "fav"
+ACTION_DELETE = "del"
+
+_ACTION_TEXT = {
+    ACTION_FAVORITE: ("⭐ В избранное", "⭐"),
+    ACTION_DELETE: ("🗑 Удалить из избранного", "🗑"),
+}
+
+CAPTION_LIMIT = 1024        # подпись к фото в Telegram
+SUMMARY_OVERVIEW_LIMIT = 200  # описание в общем списке альбомного режима
+BUTTON_TEXT_LIMIT = 64
+DESCRIPTION_LIMIT = 120     # описание результата в inline-режиме
+
+Keyboard = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, None]
+
+# Статические клавиатуры: собираются один раз при импорте и переиспользуются
+TOP_BUTTON = "🔥 Топ-3"
+RECOMMENDATIONS_BUTTON = "🎯 Рекомендации"
+NEW_BUTTON = "🆕 Новинки"
+FAVORITES_BUTTON = "⭐ Избранное"
+BACK_TO_GENRES_BUTTON = "🔙 Назад к выбору жанра"
+
+
+def _build_genre_keyboard() -> ReplyKeyboardMarkup:
+    buttons = [KeyboardButton(text=genre) for genre in GENRES]
+    rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    rows.append([KeyboardButton(text=TOP_BUTTON), KeyboardButton(text=RECOMMENDATIONS_BUTTON), KeyboardButton(text=NEW_BUTTON)])
+    rows.append([KeyboardButton(text=FAVORITES_BUTTON)])
+    return ReplyKeyboardMarkup(resize_keyboard=True, keyboard=rows)
+
+
+GENRE_KEYBOARD = _build_genre_keyboard()
+BACK_KEYBOARD = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[[KeyboardButton(text=BACK_TO_GENRES_BUTTON)]])
+BACK_BUTTON = InlineKeyboardButton(text="🔙 Назад", callback_data="back")
+NOTIFICATION_KEYBOARDS = {
+    enabled: InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text="🔕 Отключить уведомления" if enabled else "🔔 Включить уведомления",
+            callback_data="toggle_notifications",
+        )
+    ]])
+    for enabled in (True, False)
+}
+MORE_MOVIES_KEYBOARDS = {
+    genre: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Посмотреть ещё 🎥", callback_data=f"more_{genre}")],
+        [BACK_BUTTON],
+    ])
+    for genre in GENRES
+}
+
+
+@lru_cache(maxsize=64)
+def search_more_keyboard(page: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="🔎 Посмотреть ещё", callback_data=f"search_more|{page}")
+    ]])
+
+
+class MovieCard:
+    """Готовое представление фильма: тексты, клавиатура и постер."""
+
+    __slots__ = (
+        "movie_id", "title", "poster_path", "caption", "album_caption", "summary", "markup",
+        "_action", "_buttons", "_year", "_overview", "_article",
+    )
+
+    def __init__(self, action: str, movie_id: int, title: str, year: str, overview: str, poster_path: Optional[str]):
+        escaped_title = html.escape(title)
+        self.movie_id = movie_id
+        self.title = title
+        self.poster_path = poster_path
+        self.caption = _truncate(f"🎬 <b>{escaped_title} ({year})</b>\n\n", overview, CAPTION_LIMIT)
+        self.album_caption = f"<b>{escaped_title}</b> ({year})"
+        self.summary = _truncate(f"{self.album_caption}\n", overview, SUMMARY_OVERVIEW_LIMIT + len(self.album_caption) + 1)
+        self.markup = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text=_ACTION_TEXT[action][0], callback_data=f"{action}_{movie_id}")
+        ]])
+        self._action = action
+        self._buttons: dict[int, InlineKeyboardButton] = {}
+        self._year = year
+        self._overview = overview
+        self._article: Optional[InlineQueryResultArticle] = None
+
+    def list_button(self, number: int) -> InlineKeyboardButton:
+        """Кнопка фильма под общим списком (с номером фильма в списке)."""
+        button = self._buttons.get(number)
+        if button is None:
+            icon = _ACTION_TEXT[self._action][1]
+            button = InlineKeyboardButton(
+                text=f"{icon} {number}. {self.title}"[:BUTTON_TEXT_LIMIT],
+                callback_data=f"{self._action}_{self.movie_id}",
+            )
+            self._buttons[number] = button
+        return button
+
+    def article(self) -> InlineQueryResultArticle:
+        """Результат inline-запроса: при выборе в чат уходит текст карточки."""
+        if self._article is None:
+            description = self._overview
+            if len(description) > DESCRIPTION_LIMIT:
+                description = description[:DESCRIPTION_LIMIT - 1].rstrip() + "…"
+            self._article = InlineQueryResultArticle(
+                id=str(self.movie_id),
+                title=f"{self.title} ({self._year})",
+                description=description,
+                thumbnail_url=thumbnail_url(self.poster_path),
+                input_message_content=InputTextMessageContent(message_text=self.caption, parse_mode=PARSE_MODE),
+            )
+        return self._article
+
+
+def _truncate(head: str, overview: str, limit: int) -> str:
+    # Обрезаем исходный текст, а не экранированный, чтобы не разрезать HTML-сущность
+    room = limit - len(head)
+    if len(html.escape(overview)) > room:
+        overview = overview[:max(room - 1, 0)]
+        while len(html.escape(overview)) > room - 1:
+            overview = overview[:-1]
+        overview = overview.rstrip() + "…"
+    return head + html.escape(overview)
+
+
+@lru_cache(maxsize=CARD_CACHE_SIZE)
+def _card(action: str, movie_id: int, title: str, year: str, overview: str, poster_path: Optional[str]) -> MovieCard:
+    return MovieCard(action, movie_id, title, year, overview, poster_path)
+
+
+def movie_card(movie: dict, action: str = ACTION_FAVORITE) -> MovieCard:
+    """Карточка фильма из кэша; ключ — поля, от которых зависит вывод."""
+    return _card(
+        action,
+        movie["id"],
+        movie.get("title") or "Без названия",
+        (movie.get("release_date") or "неизвестно")[:4],
+        movie.get("overview") or "Описание отсутствует.",
+        movie.get("poster_path"),
+    )
+
+
+async def send_movie_list(
+    bot: Bot,
+    chat_id: int,
+    movies: list[dict],
+    footer_text: str,
+    footer_keyboard: Keyboard = None,
+    action: str = ACTION_FAVORITE,
+    mode: Optional[str] = None,
+) -> None:
+    """Отправляет список фильмов в выбранном режиме (по умолчанию LIST_RENDER_MODE)."""
+    cards = [movie_card(movie, action) for movie in movies]
+    if (mode or LIST_RENDER_MODE) == "cards":
+        await send_movie_cards(bot, chat_id, cards, footer_text, footer_keyboard)
+    else:
+        await send_movie_album(bot, chat_id, cards, footer_text, footer_keyboard)
+
+
+async def send_movie_album(bot: Bot, chat_id: int, cards: list[MovieCard], footer_text: str,
+                           footer_keyboard: Keyboard = None) -> None:
+    """Постеры одним альбомом, затем одно сообщение со списком и кнопками для каждого фильма."""
+    posters = [
+        (card.poster_path, f"{i}. {card.album_caption}")
+        for i, card in enumerate(cards, 1) if card.poster_path
+    ]
+    if posters:
+        try:
+            await send_poster_album(bot, chat_id, posters, parse_mode=PARSE_MODE)
+        except Exception as e:
+            # Без постеров список всё равно будет понятен по тексту ниже
+            logger.error(f"Ошибка при отправке альбома постеров в чат {chat_id}: {e}")
+
+    lines = [f"{i}. {card.summary}" for i, card in enumerate(cards, 1)]
+    rows = [[card.list_button(i)] for i, card in enumerate(cards, 1)]
+
+    # В одном сообщении может быть только inline-клавиатура: обычную заменяем кнопкой «Назад»
+    if isinstance(footer_keyboard, InlineKeyboardMarkup):
+        rows.extend(footer_keyboard.inline_keyboard)
+    elif isinstance(footer_keyboard, ReplyKeyboardMarkup):
+        rows.append([BACK_BUTTON])
+
+    text = "\n\n".join(lines + [footer_text])
+    await bot.send_message(chat_id, text, parse_mode=PARSE_MODE, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+
+async def send_movie_cards(bot: Bot, chat_id: int, cards: list[MovieCard], footer_text: str,
+                           footer_keyboard: Keyboard = None) -> None:
+    """Отдельная карточка на каждый фильм и завершающее сообщение с клавиатурой."""
+    for card in cards:
+        try:
+            if card.poster_path:
+                await send_poster(bot, chat_id, card.poster_path, caption=card.caption,
+                                  parse_mode=PARSE_MODE, reply_markup=card.markup)
+            else:
+                await bot.send_message(chat_id, card.caption, parse_mode=PARSE_MODE, reply_markup=card.markup)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке фильма {card.title}: {str(e)}")
+
+    await bot.send_message(chat_id, footer_text, parse_mode=PARSE_MODE, reply_markup=footer_keyboard)
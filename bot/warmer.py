@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from bot.api_tmdb import GENRES, BASE_URL, tmdb, endpoint_ttl
+from bot.config import CACHE_WARM_ENABLED, CACHE_WARM_LEAD, CACHE_WARM_JITTER, CACHE_WARM_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[], Awaitable[dict]]
+
+
+def _feeds() -> dict[str, tuple[str, list[Loader]]]:
+    """Общие ленты: имя → (эндпоинт для TTL, загрузчики с refresh=True)."""
+    return {
+        "trending": ("/trending/movie/week", [lambda: tmdb.recommendations(refresh=True)]),
+        "top_rated": ("/movie/top_rated", [lambda: tmdb.top_movies(refresh=True)]),
+        "now_playing": ("/movie/now_playing", [lambda: tmdb.new_movies(refresh=True)]),
+        "genres": ("/discover/movie", [
+            (lambda genre=genre: tmdb.movies_by_genre(genre, 1, refresh=True)) for genre in GENRES
+        ]),
+    }
+
+
+async def warm(name: str, loaders: list[Loader], concurrency: int = CACHE_WARM_CONCURRENCY) -> tuple[int, int]:
+    """Обновляет записи кэша ленты; возвращает (успешно, всего)."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(load: Loader) -> bool:
+        async with semaphore:
+            try:
+                return "error" not in await load()
+            except Exception as e:
+                logger.error(f"Прогрев {name}: {e}")
+                return False
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(run(load) for load in loaders))
+    ok = sum(results)
+    logger.info(f"Прогрев кэша {name}: {ok}/{len(loaders)} за {time.monotonic() - started:.2f} с")
+    return ok, len(loaders)
+
+
+def schedule(scheduler: AsyncIOScheduler) -> None:
+    """Добавляет задачи прогрева: первый запуск вскоре после старта, далее — незадолго до истечения TTL."""
+    if not CACHE_WARM_ENABLED:
+        return
+    for name, (path, loaders) in _feeds().items():
+        ttl = endpoint_ttl(BASE_URL + path)
+        interval = max(ttl - CACHE_WARM_LEAD - CACHE_WARM_JITTER, 60)
+        scheduler.add_job(
+            warm, "interval", args=[name, loaders], seconds=interval, jitter=CACHE_WARM_JITTER,
+            id=f"warm_{name}", max_instances=1, coalesce=True,
+        )
+        # Первый прогрев вскоре после старта; со сдвигом, чтобы одновременно запущенные процессы
+        # и разные ленты не приходили в TMDB одной пачкой
+        scheduler.add_job(
+            warm, "date", args=[name, loaders], id=f"warm_{name}_startup",
+            run_date=datetime.now() + timedelta(seconds=random.uniform(0, CACHE_WARM_JITTER)),
+        )
@@ -0,0 +1,164 @@
+import asyncio
+import hmac
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from bot import metrics
+from bot.config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_CONNECTIONS,
+    UPDATE_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_DRAIN_TIMEOUT = 30  # секунд на обработку начатых обновлений при остановке
+
+
+@dataclass
+class PipelineStats:
+    accepted: int = 0
+    rejected: int = 0
+    processed: int = 0
+    failed: int = 0
+
+
+class UpdatePipeline:
+    """Обработка обновлений webhook: Telegram получает ответ только после обработки.
+
+    Пока ответа нет, Telegram считает обновление недоставленным и после падения или перезапуска
+    пришлёт его снова. Одновременно обрабатывается не больше workers обновлений; сверх этого
+    отвечаем 503, и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, workers: int = UPDATE_WORKERS):
+        self.bot = bot
+        self.dp = dp
+        self.workers_count = workers
+        self.stats = PipelineStats()
+        # Задача обработки → update_id
+        self._tasks: dict[asyncio.Task, Optional[int]] = {}
+        self._closing = False
+        self._last_warning = 0.0
+
+    async def start(self) -> None:
+        metrics.on_scrape(lambda: metrics.UPDATE_QUEUE_DEPTH.labels("webhook").set(len(self._tasks)))
+
+    async def process(self, raw_update: dict) -> bool:
+        """Обрабатывает обновление и дожидается конца обработки; False — свободных обработчиков нет."""
+        if self._closing or len(self._tasks) >= self.workers_count:
+            self.stats.rejected += 1
+            self._warn_backpressure()
+            return False
+        self.stats.accepted += 1
+        task = asyncio.create_task(self._handle(raw_update))
+        self._tasks[task] = raw_update.get("update_id")
+        task.add_done_callback(self._tasks.pop)
+        # Если Telegram оборвёт соединение, обработка всё равно завершится
+        await asyncio.shield(task)
+        return True
+
+    def _warn_backpressure(self) -> None:
+        now = time.monotonic()
+        if now - self._last_warning >= 10:
+            self._last_warning = now
+            logger.warning(f"Все обработчики обновлений заняты: {self.snapshot()}")
+
+    def snapshot(self) -> dict:
+        return {
+            "busy_workers": len(self._tasks),
+            "workers": self.workers_count,
+            "accepted": self.stats.accepted,
+            "rejected": self.stats.rejected,
+            "processed": self.stats.processed,
+            "failed": self.stats.failed,
+        }
+
+    async def _handle(self, raw_update: dict) -> None:
+        try:
+            await self.dp.feed_raw_update(self.bot, raw_update)
+            self.stats.processed += 1
+        except Exception as e:
+            # Ошибка обработчика — не повод для повторной доставки: отвечаем 200, чтобы не зациклиться
+            self.stats.failed += 1
+            logger.exception(f"Ошибка обработки обновления {raw_update.get('update_id')}: {e}")
+
+    async def stop(self, timeout: float = SHUTDOWN_DRAIN_TIMEOUT) -> None:
+        """Перестаёт принимать обновления и дообрабатывает начатые."""
+        self._closing = True
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        if pending:
+            update_ids = sorted(self._tasks[task] or 0 for task in pending if task in self._tasks)
+            # Ответа на них Telegram не получил — обновления будут доставлены повторно
+            logger.error(f"Не успели обработать {len(pending)} обновлений при остановке: {update_ids}")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def create_app(pipeline: UpdatePipeline, path: str = WEBHOOK_PATH,
+               secret: Optional[str] = WEBHOOK_SECRET) -> web.Application:
+    """aiohttp-приложение: приём обновлений, состояние очереди и метрики."""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, secret):
+                return web.Response(status=401)
+        raw_update = await request.json()
+        # Отвечаем после обработки: до ответа обновление остаётся за Telegram и переживёт наш перезапуск
+        if not await pipeline.process(raw_update):
+            # Не 2xx — Telegram оставит обновление у себя и повторит доставку позже
+            return web.Response(status=503)
+        return web.Response()
+
+    async def handle_health(request: web.Request) -> web.Response:
+        return web.json_response(pipeline.snapshot())
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", handle_health)
+    metrics.add_routes(app)
+    return app
+
+
+async def register_webhook(bot: Bot, allowed_updates: list[str]) -> None:
+    """Регистрирует webhook в Telegram."""
+    if not WEBHOOK_URL:
+        raise EnvironmentError("Для BOT_MODE=webhook задайте WEBHOOK_URL.")
+    # Накопившиеся обновления не сбрасываем: Telegram доставит их на новый адрес
+    await bot.set_webhook(
+        url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=allowed_updates,
+        drop_pending_updates=False,
+    )
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Запускает бота в режиме webhook и работает до отмены."""
+    if not WEBHOOK_URL:
+        raise EnvironmentError("Для BOT_MODE=webhook задайте WEBHOOK_URL.")
+
+    pipeline = UpdatePipeline(bot, dp)
+    await pipeline.start()
+    runner = web.AppRunner(create_app(pipeline))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    await register_webhook(bot, dp.resolve_used_update_types())
+    logger.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await dp.emit_startup(bot=bot)
+        await asyncio.Event().wait()
+    finally:
+        # Сначала перестаём принимать новые обновления, затем дообрабатываем начатые
+        await runner.cleanup()
+        await pipeline.stop()
+        await dp.emit_shutdown(bot=bot)